@@ -0,0 +1,72 @@
+import os
+import urllib.parse
+from collections import Counter
+from dataclasses import dataclass, field
+
+VIDEO_EXTENSIONS = ('.mp4', '.webm')
+
+# ----------------------------------------------------------------------------------------- #
+# Distribution buckets - scores and comment counts by power of ten, a bucket is its lower bound
+BUCKET_BOUNDS = (0, 1, 10, 100, 1000, 10000, 100000)
+NEGATIVE_BUCKET = -1
+
+def bucket(value: int) -> int:
+    if value < 0:
+        return NEGATIVE_BUCKET
+    return max(bound for bound in BUCKET_BOUNDS if bound <= value)
+
+def bucket_label(lower: int) -> str:
+    if lower == NEGATIVE_BUCKET:
+        return '<0'
+    if lower == BUCKET_BOUNDS[-1]:
+        return f'{lower}+'
+    upper = BUCKET_BOUNDS[BUCKET_BOUNDS.index(lower) + 1] - 1
+    return str(lower) if upper == lower else f'{lower}-{upper}'
+
+def media_kind(url: str | None) -> str | None:
+    """
+        'video', 'image' or None for posts without media, as the media column holds both
+    """
+    if not url:
+        return None
+    parsed = urllib.parse.urlparse(url)
+    if parsed.netloc == 'v.redd.it' or os.path.splitext(parsed.path)[1].lower() in VIDEO_EXTENSIONS:
+        return 'video'
+    return 'image'
+
+# ----------------------------------------------------------------------------------------- #
+# Report rollup - what one report adds to its subreddit's analytics for the day it was crawled
+@dataclass
+class ReportRollup:
+    reports: int = 1
+    snapshots: int = 0          # Posts in the report
+    score_total: int = 0
+    comment_total: int = 0
+    new_posts: int = 0          # Posts no earlier report had crawled
+    image_posts: int = 0        # Of the new posts
+    video_posts: int = 0
+    score_buckets: Counter = field(default_factory=Counter)
+    comment_buckets: Counter = field(default_factory=Counter)
+    authors: Counter = field(default_factory=Counter) # New posts per author
+
+def rollup_report(snapshots, new_posts, reports: int = 1) -> ReportRollup:
+    """
+        snapshots are the (post_score, comment_count) of every post in the report, new_posts the
+        (post_author, media_content) of the posts it crawled first
+    """
+    rollup = ReportRollup(reports=reports)
+    for score, comments in snapshots:
+        rollup.snapshots += 1
+        rollup.score_total += score
+        rollup.comment_total += comments
+        rollup.score_buckets[bucket(score)] += 1
+        rollup.comment_buckets[bucket(comments)] += 1
+    for author, media_content in new_posts:
+        rollup.new_posts += 1
+        rollup.authors[author] += 1
+        kind = media_kind(media_content)
+        if kind == 'image':
+            rollup.image_posts += 1
+        elif kind == 'video':
+            rollup.video_posts += 1
+    return rollup
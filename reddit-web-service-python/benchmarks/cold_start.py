@@ -0,0 +1,36 @@
+"""
+    One cold start of a web worker, run in a fresh interpreter by run_benchmarks.py - times the
+    import of crawl_application, create_app() and the first request, and lists the crawler and
+    Telegram modules the web tier loaded. Prints the results as one JSON line
+"""
+import contextlib
+import json
+import os
+import sys
+import time
+
+# Only the crawler, bot, Parquet exports and media thumbnails need these, a web worker should start without them
+HEAVY_MODULES = ('selenium.webdriver', 'webdriver_manager', 'bs4', 'telegram', 'pyarrow', 'requests', 'PIL')
+
+def main() -> None:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    with contextlib.redirect_stdout(sys.stderr):
+        start = time.perf_counter()
+        import crawl_application
+        imported = time.perf_counter()
+        app = crawl_application.create_app()
+        created = time.perf_counter()
+        response = app.test_client().get('/')
+        answered = time.perf_counter()
+    if response.status_code != 200:
+        raise RuntimeError(f"First request failed with status {response.status_code}")
+
+    print(json.dumps({
+        'import': imported - start,
+        'create_app': created - imported,
+        'first_request': answered - created,
+        'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules]
+    }))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""
+    Offline benchmarks for the crawl pipeline - extraction, media detection, report persistence,
+    rendering, view_report, post search and analytics, run against synthetic subreddit pages
+    served on localhost, and the cold start of a web worker.
+
+    python benchmarks/run_benchmarks.py                     # Compare against baseline.json
+    python benchmarks/run_benchmarks.py --update-baseline   # Store the results as the new baseline,
+                                                            # committed on its own after the change it measures
+    python benchmarks/run_benchmarks.py --browser           # Also time extraction in headless Chrome
+
+    Exits with status 1 when a benchmark is slower than its baseline by more than --threshold, twice
+    as slow by default. Each benchmark keeps its fastest sample, as noise from the rest of the machine
+    only ever adds time, and benchmarks that write start every call from the same database.
+    Slower benchmarks are measured again in up to --rounds runs of every suite, keeping the fastest.
+    On a quiet machine a lower threshold, e.g. --threshold 0.25, catches smaller regressions
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCHMARK_DIRECTORY, 'baseline.json')
+DEFAULT_SIZES = (25, 250, 1000, 5000)
+
+# The application is pointed at a scratch database and directories before it is imported,
+# and crawls of the local page server are not rate limited
+work_directory = tempfile.mkdtemp(prefix='crawler-bench-')
+os.environ['CRAWLER_DATABASE'] = os.path.join(work_directory, 'bench.db')
+os.environ['REPORT_DIRECTORY'] = os.path.join(work_directory, 'reports')
+os.environ['MEDIA_DIRECTORY'] = os.path.join(work_directory, 'media')
+os.environ['PAGE_ARCHIVE_DIRECTORY'] = os.path.join(work_directory, 'archive')
+os.environ['CRAWL_RATE_LIMIT'] = '0'
+os.environ.pop('METRICS_LOG', None)
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIRECTORY))
+
+import requests
+
+from synthetic_pages import serve_pages, synthetic_posts
+from reddit_crawler import ScrollWaitPolicy, build_post, collect_posts, detect_media, extract_posts_from_html
+from http_crawler import HttpBackend
+from media_enrichment import MediaEnricher, MediaStore
+
+with contextlib.redirect_stdout(open(os.devnull, 'w')):
+    import crawl_application as application
+
+# ----------------------------------------------------------------------------------------- #
+# Timing - every benchmark is run repeat times and the fastest sample is compared with the baseline
+# Fast benchmarks are looped until a sample takes MIN_SAMPLE_SECONDS so timer noise stays small
+MIN_SAMPLE_SECONDS = 0.1
+
+def measure(function, repeat: int, setup = None) -> float:
+    """
+        Fastest seconds per call of function over repeat samples. setup runs untimed before
+        every call, so calls that change state can each start from the same state
+    """
+    def sample(number: int) -> float:
+        elapsed = 0.0
+        for calls in ([1] * number if setup else [number]):
+            if setup:
+                setup()
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                for _ in range(calls):
+                    function()
+                elapsed += time.perf_counter() - start
+            finally:
+                gc.enable()
+        return elapsed
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull): # Crawl progress prints
+        number = 1
+        elapsed = sample(number) # Warm up, also sizes the loop
+        while elapsed < MIN_SAMPLE_SECONDS:
+            number = max(number * 2, int(number * MIN_SAMPLE_SECONDS / max(elapsed, 1e-6)))
+            elapsed = sample(number)
+        timings = [sample(number) / number for _ in range(repeat)]
+    return min(timings)
+
+def bench_posts(count: int, prefix: str) -> list:
+    return [post for post in map(build_post, synthetic_posts(count, prefix)) if post]
+
+# Database state - benchmarks that save reports restore this copy of the freshly migrated database
+# before every call, so the posts stored by earlier calls never change the work of the next one
+EMPTY_DATABASE = os.path.join(work_directory, 'bench-empty.db')
+
+def snapshot_database() -> None:
+    application.db.session.remove()
+    application.db.engine.dispose() # Closing the last connection checkpoints the WAL into the file
+    shutil.copyfile(os.environ['CRAWLER_DATABASE'], EMPTY_DATABASE)
+
+def remove_database() -> None:
+    application.db.session.remove()
+    application.db.engine.dispose()
+    database = os.environ['CRAWLER_DATABASE']
+    for suffix in ('', '-wal', '-shm'):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(database + suffix)
+
+def restore_database() -> None:
+    remove_database()
+    shutil.copyfile(EMPTY_DATABASE, os.environ['CRAWLER_DATABASE'])
+    application.db.session.execute(application.select(1)) # Connects outside the timed call
+
+# ----------------------------------------------------------------------------------------- #
+# Benchmarks - each yields (name, items processed, seconds)
+def bench_extraction(base_url: str, sizes, repeat: int):
+    session = requests.Session()
+    backend = HttpBackend(base_url=base_url, retries=0)
+    for size in sizes:
+        url = f"{base_url}/r/bench{size}/new"
+        session.get(url).raise_for_status() # Renders and caches the page on the server
+
+        def soup_extract():
+            html = session.get(url).text
+            collect_posts(extract_posts_from_html(html), [], set())
+        yield f'extract_soup[{size}]', size, measure(soup_extract, repeat)
+        yield f'http_crawl[{size}]', size, measure(lambda: backend.crawl(f'bench{size}', 'new', size), repeat)
+
+def bench_browser_extraction(base_url: str, sizes, repeat: int):
+    from driver_pool import DriverPool
+    from reddit_crawler import _crawl_page
+
+    pool = DriverPool(size=1)
+    policy = ScrollWaitPolicy(timeout=1, max_scrolls=0) # Every post is on the first screen
+    try:
+        for size in sizes:
+            def browser_extract():
+                with pool.lease() as driver:
+                    _crawl_page(driver, f"{base_url}/r/bench{size}/new", size, policy, 'browser')
+            yield f'extract_browser[{size}]', size, measure(browser_extract, repeat)
+    finally:
+        pool.shutdown()
+
+def bench_detect_media(repeat: int):
+    hrefs = [attributes['content-href'] for attributes in synthetic_posts(10000)]
+    hrefs += [None] * 1000
+    yield 'detect_media[11000]', len(hrefs), measure(lambda: [detect_media(href) for href in hrefs], repeat)
+
+def bench_media_enrichment(base_url: str, repeat: int, count: int = 100):
+    urls = [f"{base_url}/media/{number}.png" for number in range(count)]
+    enricher = MediaEnricher(MediaStore(os.path.join(work_directory, 'media-bench')), allow_private=True)
+
+    def empty_store():
+        # An empty store every run, so every image is stored and thumbnailed again
+        enricher.store = MediaStore(tempfile.mkdtemp(dir=work_directory))
+    yield f'enrich_media[{count}]', count, measure(lambda: enricher.enrich(urls), repeat, setup=empty_store)
+
+    enricher.store = MediaStore(os.path.join(work_directory, 'media-bench'))
+    enricher.enrich(urls)
+    yield f'enrich_media_stored[{count}]', count, measure(lambda: enricher.enrich(urls), repeat)
+
+def bench_reports(sizes, repeat: int):
+    app = application.app
+    client = app.test_client()
+    with app.app_context():
+        remove_database() # Left by an earlier round
+        application.db.create_all()
+        application.migrate_database()
+        snapshot_database()
+
+        for size in sizes:
+            posts = bench_posts(size, prefix=f"s{size}_")
+            report_ids = []
+
+            def save():
+                # Into the empty database every time, so every post is inserted and indexed
+                report = application.save_report('bench', 'new', posts, f"report_bench_new_{size}.pdf")
+                report_ids.append(report.id)
+            yield f'save_report[{size}]', size, measure(save, repeat, setup=restore_database)
+
+            report_id = report_ids[-1]
+            with app.test_request_context():
+                yield f'render_report[{size}]', size, measure(lambda: application.generate_html(report_id), repeat)
+
+            def view_cold():
+                application.report_cache.invalidate(report_id)
+                client.get(f'/view_report/{report_id}', headers={'Accept-Encoding': 'gzip'}).get_data()
+            yield f'view_report_cold[{size}]', size, measure(view_cold, repeat)
+
+            def view_warm():
+                client.get(f'/view_report/{report_id}', headers={'Accept-Encoding': 'gzip'}).get_data()
+            yield f'view_report_warm[{size}]', size, measure(view_warm, repeat)
+
+def bench_queries(repeat: int, count: int = 10000):
+    # Searches a fixed set of posts whose titles alone hold the word "indexed", so the other
+    # benchmarks' posts do not change the work. The common term matches and ranks all of them
+    app = application.app
+    with app.app_context():
+        posts = bench_posts(count, prefix='query_')
+        for post in posts:
+            post.post_title = f"Indexed {post.post_title}"
+        application.save_report('query', 'new', posts, 'report_query.pdf')
+
+        yield 'search_phrase', 1, measure(lambda: application.search_posts('"indexed synthetic post 42"'), repeat)
+        yield f'search_common[{count}]', len(posts), measure(lambda: application.search_posts('indexed'), repeat)
+        # Reads only the rollups, so it should not grow with the posts bench_reports stored
+        yield 'subreddit_analytics', 1, measure(lambda: application.subreddit_analytics('bench'), repeat)
+
+def bench_startup(repeat: int):
+    # Fresh interpreters, as a restarted web worker, against the database the other suites filled
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, os.path.join(BENCHMARK_DIRECTORY, 'cold_start.py')],
+                                capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output))
+    heavy_modules = sorted({name for run in runs for name in run['heavy_modules']})
+    if heavy_modules:
+        raise RuntimeError(f"The web tier imported {', '.join(heavy_modules)} at start up")
+
+    for phase in ('import', 'create_app', 'first_request'):
+        yield f'startup_{phase}', 1, min(run[phase] for run in runs)
+
+# ----------------------------------------------------------------------------------------- #
+# Baseline comparison
+def load_baseline() -> dict:
+    try:
+        with open(BASELINE_PATH, encoding='utf-8') as f:
+            return json.load(f)['results']
+    except FileNotFoundError:
+        return {}
+
+def save_baseline(results: dict) -> None:
+    with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'results': results
+        }, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print(f"Baseline written to {BASELINE_PATH}")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Offline crawl pipeline benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Posts per synthetic page')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per benchmark, the fastest is kept')
+    # Fastest samples of two unchanged runs on a shared single core VM still differ by up to 2x
+    parser.add_argument('--threshold', type=float, default=1.0, help='Allowed slowdown over the baseline, 1.0 = 100%%')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='Runs of every suite, further rounds only run while a benchmark looks slower')
+    parser.add_argument('--browser', action='store_true', help='Also benchmark extraction in headless Chrome')
+    parser.add_argument('--update-baseline', action='store_true', help='Store these results as the baseline')
+    args = parser.parse_args()
+
+    server = serve_pages()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    def run_suites():
+        suites = [
+            bench_extraction(base_url, args.sizes, args.repeat),
+            bench_detect_media(args.repeat),
+            bench_media_enrichment(base_url, args.repeat),
+            bench_reports(args.sizes, args.repeat),
+            bench_queries(args.repeat),
+            bench_startup(args.repeat)
+        ]
+        if args.browser:
+            suites.append(bench_browser_extraction(base_url, args.sizes, args.repeat))
+        for suite in suites:
+            yield from suite
+
+    baseline = load_baseline()
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<26}{'seconds':>12}{'items/s':>14}{'baseline':>12}{'change':>10}")
+    for round_number in range(1, args.rounds + 1):
+        if round_number > 1:
+            if not regressions or args.update_baseline:
+                break
+            # A slow spell of the machine lasts longer than one benchmark's samples, so a regression
+            # only counts when it is still there in another run of every suite
+            print(f"Measuring again, round {round_number} of {args.rounds}: {', '.join(regressions)}")
+        checked, regressions = regressions, []
+        for name, items, seconds in run_suites():
+            results[name] = min(seconds, results.get(name, seconds))
+            if round_number > 1 and name not in checked:
+                continue
+            seconds = results[name]
+            previous = baseline.get(name)
+            change = f"{(seconds / previous - 1) * 100:+.1f}%" if previous else '-'
+            print(f"{name:<26}{seconds:>12.5f}{items / seconds:>14.0f}{previous or 0:>12.5f}{change:>10}")
+            if previous and seconds > previous * (1 + args.threshold):
+                regressions.append(name)
+    server.shutdown()
+    shutil.rmtree(work_directory, ignore_errors=True)
+
+    if args.update_baseline:
+        save_baseline({**baseline, **results})
+        return 0
+    if regressions:
+        print(f"ERROR: {len(regressions)} benchmarks are more than {args.threshold:.0%} slower than the baseline: "
+              f"{', '.join(regressions)}")
+        return 1
+    print("No regressions against the baseline")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
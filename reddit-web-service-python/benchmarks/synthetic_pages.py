@@ -0,0 +1,156 @@
+import functools
+import html
+import json
+import re
+import struct
+import threading
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ----------------------------------------------------------------------------------------- #
+# Synthetic subreddit data - deterministic posts with the same attributes reddit.com renders
+MEDIA_LINKS = (
+    'https://i.redd.it/{id}.jpeg',
+    'https://v.redd.it/{id}',
+    'https://www.reddit.com/gallery/{id}',
+    'https://example.com/articles/{id}?ref=reddit',
+    'https://i.imgur.com/{id}.gif',
+    None # Self post, content-href is the permalink
+)
+
+def synthetic_post(number: int, prefix: str = '') -> dict:
+    """
+        Attributes of one shreddit-post element, every 50th post is missing its author
+    """
+    post_id = f"{prefix}{number:x}"
+    perma_link = f"/r/bench/comments/{post_id}/synthetic_post_{number}/"
+    link = MEDIA_LINKS[number % len(MEDIA_LINKS)]
+    return {
+        'id': f"t3_{post_id}",
+        'permalink': perma_link,
+        'content-href': link.format(id=post_id) if link else f"https://www.reddit.com{perma_link}",
+        'comment-count': str(number * 7 % 1500),
+        'post-title': f"Synthetic post {number} - benchmarking the crawler pipeline & report rendering",
+        'author': None if number % 50 == 49 else f"bench_user_{number % 97}",
+        'score': str(number * 31 % 25000)
+    }
+
+def synthetic_posts(count: int, prefix: str = '') -> list[dict]:
+    return [synthetic_post(number, prefix) for number in range(count)]
+
+def render_page(count: int) -> str:
+    """
+        A subreddit page with count shreddit-post elements wrapped in the usual markup
+    """
+    parts = ['<!DOCTYPE html><html><head><title>r/bench</title></head><body><shreddit-app><main>']
+    for attributes in synthetic_posts(count):
+        attribute_text = ' '.join(f'{name}="{html.escape(value)}"' for name, value in attributes.items() if value)
+        parts.append(
+            f'<article><shreddit-post {attribute_text} post-type="link">'
+            f'<a slot="full-post-link" href="{attributes["permalink"]}"><faceplate-screen-reader-content>'
+            f'{html.escape(attributes["post-title"])}</faceplate-screen-reader-content></a>'
+            f'<div slot="credit-bar"><faceplate-timeago ts="2026-01-01T00:00:00Z"></faceplate-timeago></div>'
+            f'<shreddit-post-overflow-menu></shreddit-post-overflow-menu>'
+            f'</shreddit-post></article><hr>')
+    parts.append('</main></shreddit-app></body></html>')
+    return ''.join(parts)
+
+@functools.lru_cache(maxsize=None)
+def _listing(count: int) -> tuple[list[dict], dict]:
+    posts = synthetic_posts(count)
+    return posts, {post['id']: index for index, post in enumerate(posts)}
+
+def render_listing(count: int, limit: int, after: str = None) -> dict:
+    """
+        One page of the listing JSON the http backend reads, cursor is the last post's name
+    """
+    posts, positions = _listing(count)
+    start = positions.get(after, count) + 1 if after else 0
+    page = posts[start:start + limit]
+    children = [{'kind': 't3', 'data': {
+        'name': post['id'],
+        'permalink': post['permalink'],
+        'url': post['content-href'],
+        'num_comments': int(post['comment-count']),
+        'title': post['post-title'],
+        'author': post['author'],
+        'score': int(post['score'])
+    }} for post in page]
+    next_after = page[-1]['id'] if page and start + limit < count else None
+    return {'kind': 'Listing', 'data': {'after': next_after, 'children': children}}
+
+def sample_png(number: int, width: int = 640, height: int = 480) -> bytes:
+    """
+        A gradient PNG that differs per number, so every sample image has its own content hash
+    """
+    row = bytes((x * 255 // width + number * 37) % 256 for x in range(width) for _ in range(3))
+    raw = b''.join(b'\x00' + row[y % 3:] + row[:y % 3] for y in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+# ----------------------------------------------------------------------------------------- #
+# Local page server - /r/bench<count>/new serves the page, /r/bench<count>/new.json the listing
+# and /media/<number>.png a sample image
+PAGE_PATH = re.compile(r'^/r/bench(\d+)/(\w+)(\.json)?/?$')
+MEDIA_PATH = re.compile(r'^/media/(\d+)\.png$')
+
+class SyntheticPageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, like the pooled sessions talking to reddit.com
+    disable_nagle_algorithm = True # Headers and body are separate writes
+    pages = {} # Rendered pages and images are cached so the benchmark measures the crawler, not the server
+    images = {}
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        match = PAGE_PATH.match(url.path)
+        media = MEDIA_PATH.match(url.path)
+        if not match and not media:
+            self.send_error(404)
+            return
+
+        if media:
+            number = int(media.group(1))
+            if number not in self.images:
+                self.images[number] = sample_png(number)
+            body = self.images[number]
+            content_type = 'image/png'
+        elif match.group(3):
+            count = int(match.group(1))
+            query = urllib.parse.parse_qs(url.query)
+            limit = int(query.get('limit', ['25'])[0])
+            body = json.dumps(render_listing(count, limit, query.get('after', [None])[0])).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            count = int(match.group(1))
+            if count not in self.pages:
+                self.pages[count] = render_page(count).encode('utf-8')
+            body = self.pages[count]
+            content_type = 'text/html; charset=utf-8'
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+class SyntheticPageServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # Concurrent fetches would otherwise overflow the listen backlog
+
+def serve_pages() -> ThreadingHTTPServer:
+    """
+        Starts the page server on a free local port, base url is http://127.0.0.1:<server_port>
+    """
+    server = SyntheticPageServer(('127.0.0.1', 0), SyntheticPageHandler)
+    threading.Thread(target=server.serve_forever, name="synthetic-pages", daemon=True).start()
+    return server
@@ -1,30 +1,63 @@
 import os
+import signal
 import threading
+import time
 import asyncio
+from typing import TYPE_CHECKING
 
 from dotenv import load_dotenv
-from reddit_crawler import crawl_subreddit, Post
-from datetime import datetime, timezone
-
-from flask import Flask, render_template, redirect, url_for, send_from_directory, request
+from reddit_crawler import crawl_subreddit, collect_posts, get_backend, Post as CrawledPost
+from driver_pool import BROWSER_MODES, get_driver_pool, pool_size
+import metrics
+from report_cache import ReportCache, cached_report_response
+from crawl_cache import CachedCrawl, CrawlResultCache
+from page_archive import write_snapshot, extract_snapshots
+from media_enrichment import MediaEnricher, MediaStore
+from report_export import EXPORT_FORMATS, WRITERS, check_format
+from analytics import bucket_label, rollup_report
+from crawl_jobs import JobWorkerPool, QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED, utc_now
+from scheduler import CronSchedule, CrawlScheduler
+from telegram_delivery import TelegramSender, TelegramRateLimiter
+from datetime import datetime, timedelta, timezone
+
+import click
+
+from flask import Flask, Response, render_template, redirect, url_for, send_from_directory, request, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import event, inspect, insert, select, delete, exists, text, func, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased, configure_mappers
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
 
-from telegram import Bot, Update
-from telegram.error import TelegramError, InvalidToken
-from telegram.ext import ApplicationBuilder, CommandHandler, CallbackContext
+# python-telegram-bot is imported by the bot process only, see bot_polling
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import CallbackContext
 
 app = Flask(__name__)
 app.secret_key = 'the spice will flow'
 
 # ----------------------------------------------------------------------------------------- #
 
-# SQLite Database directory
-database = 'crawler_service.db'
+# SQLite Database directory, CRAWLER_DATABASE points it elsewhere (e.g. for benchmarks)
+database = os.getenv('CRAWLER_DATABASE', 'crawler_service.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app) # Initialisation
 
+# SQLite tuning - WAL lets report pages read while crawl workers write
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if type(dbapi_connection).__module__.startswith('sqlite3'):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')   # Safe with WAL, avoids an fsync per commit
+        cursor.execute('PRAGMA busy_timeout=5000')    # Wait on writer locks instead of failing
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA cache_size=-20000')    # 20MB page cache
+        cursor.close()
+
 # ----------------------------------------------------------------------------------------- #
 
 # Telegram bot token
@@ -32,65 +65,383 @@ token_path = os.path.join(os.path.dirname(__file__), 'token.env')
 load_dotenv(token_path)
 token = os.getenv('TOKEN')
 
-try:
-    telegram_bot = Bot(token)
-except InvalidToken:
-    print('Invalid token')
-    telegram_bot = None
-
 # ----------------------------------------------------------------------------------------- #
 
 """
     Model/Table of Report
 """
 class Report(db.Model):
+    __table_args__ = (db.Index('ix_report_subreddit_sort_timestamp', 'subreddit', 'sort', 'timestamp'),)
+
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.String(100), nullable=False)
+    timestamp = db.Column(db.String(100), nullable=False, index=True)
     subreddit = db.Column(db.String(100), nullable=False)
     sort = db.Column(db.String(100), nullable=False)
     post_count = db.Column(db.Integer, nullable=False)
     filename = db.Column(db.String(100), nullable=False)
+    telegram_file_id = db.Column(db.String(200), nullable=True) # Set by the first Telegram upload
+    snapshot_file = db.Column(db.String(200), nullable=True) # Compressed raw pages, see page_archive.py
+    cached_from = db.Column(db.String(100), nullable=True) # Timestamp of the cached crawl the posts came from
+    rolled_up = db.Column(db.Boolean, nullable=True) # Counted in the analytics rollups, unset before they existed
 
-    # one-to-many, one-to-one relationship between Report and Post
-    post = db.relationship('Post', backref='report', lazy=True, cascade='all, delete-orphan')
+    # one-to-many relationship between Report and the post snapshots taken by its crawl
+    snapshots = db.relationship('PostSnapshot', backref='report', lazy=True, cascade='all, delete-orphan')
 
     def __repr__(self):
         return f"<Report {self.id}: r/{self.subreddit}/{self.sort} ({self.target_posts})>"
 
 """
-    Model/Table of Post
+    Model/Table of Post - one canonical row per Reddit post, shared by every report that crawled it
 """
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    report_id = db.Column(db.Integer, db.ForeignKey('report.id'), nullable=False)
-    unique_id = db.Column(db.String(500), nullable=False, unique=False)
+    unique_id = db.Column(db.String(500), nullable=False, unique=True, index=True)
     perma_link = db.Column(db.String(500), nullable=False)
     href_content = db.Column(db.String(500), nullable=False)
-    comment_count = db.Column(db.Integer, nullable=False)
     post_title = db.Column(db.String(500), nullable=False)
     post_author = db.Column(db.String(500), nullable=False)
-    post_score = db.Column(db.Integer, nullable=False)
     media_content = db.Column(db.String(500), nullable=True)
+    first_seen = db.Column(db.String(100), nullable=False)
+    last_seen = db.Column(db.String(100), nullable=False)
+
+    snapshots = db.relationship('PostSnapshot', backref='post', lazy=True)
+
+    def __repr__(self):
+        return f"<Post {self.id}: '{self.post_title}' by {self.post_author}>"
+
+"""
+    Model/Table of PostSnapshot - the score and comments of a post as seen by one report's crawl
+"""
+class PostSnapshot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    report_id = db.Column(db.Integer, db.ForeignKey('report.id'), nullable=False, index=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False, index=True)
+    rank = db.Column(db.Integer, nullable=False)
+    post_score = db.Column(db.Integer, nullable=False)
+    comment_count = db.Column(db.Integer, nullable=False)
     timestamp = db.Column(db.String(100), nullable=False)
 
     def __repr__(self):
-        return f"<Post {self.id}: '{self.post_title}' by {self.post_author} (Score: {self.post_score})>"
+        return f"<PostSnapshot {self.id}: post {self.post_id} in report {self.report_id} (Score: {self.post_score})>"
 
 """
     Model/Table
 """
 class TelegramUser(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    handle = db.Column(db.String(100), nullable=False)
+    handle = db.Column(db.String(100), nullable=False, index=True)
     chat_id = db.Column(db.String(100), nullable=False)
 
     def __repr__(self):
         return f"<Telegram User: @{self.handle}, chat_id: {self.chat_id}>"
 
+"""
+    Model/Table of queued Telegram report deliveries, one row per recipient chat
+"""
+class TelegramDelivery(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    report_id = db.Column(db.Integer, nullable=False, index=True)
+    chat_id = db.Column(db.String(100), nullable=False)
+    caption = db.Column(db.String(500), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(500), nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=utc_now)
+    created_at = db.Column(db.DateTime, nullable=False, default=utc_now)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<TelegramDelivery {self.id}: report {self.report_id} to {self.chat_id} ({self.status})>"
+
+"""
+    Model/Table of queued crawl jobs
+"""
+class CrawlJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subreddit = db.Column(db.String(100), nullable=False)
+    sort = db.Column(db.String(100), nullable=False)
+    target_posts = db.Column(db.Integer, nullable=False)
+    user_handle = db.Column(db.String(100), nullable=True)
+    browser_mode = db.Column(db.String(20), nullable=True) # 'full' or 'lean', CRAWL_BROWSER_MODE when unset
+    batch_id = db.Column(db.Integer, db.ForeignKey('crawl_batch.id'), nullable=True)
+    schedule_id = db.Column(db.Integer, db.ForeignKey('crawl_schedule.id'), nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default=QUEUED, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    error = db.Column(db.String(500), nullable=True)
+    report_id = db.Column(db.Integer, nullable=True)
+    worker_id = db.Column(db.String(100), nullable=True) # host:pid of the crawl worker process running it
+    heartbeat_at = db.Column(db.DateTime, nullable=True) # Refreshed by that process while the job runs
+    run_after = db.Column(db.DateTime, nullable=False, default=utc_now)
+    created_at = db.Column(db.DateTime, nullable=False, default=utc_now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utc_now)
+
+    def to_dict(self):
+        return {
+            'id' : self.id,
+            'subreddit' : self.subreddit,
+            'sort' : self.sort,
+            'target_posts' : self.target_posts,
+            'user_handle' : self.user_handle,
+            'browser_mode' : self.browser_mode,
+            'batch_id' : self.batch_id,
+            'schedule_id' : self.schedule_id,
+            'status' : self.status,
+            'attempts' : self.attempts,
+            'max_attempts' : self.max_attempts,
+            'error' : self.error,
+            'report_id' : self.report_id,
+            'worker_id' : self.worker_id,
+            'created_at' : self.created_at.isoformat() if self.created_at else None,
+            'updated_at' : self.updated_at.isoformat() if self.updated_at else None
+        }
+
+    def __repr__(self):
+        return f"<CrawlJob {self.id}: r/{self.subreddit}/{self.sort} ({self.status})>"
+
+"""
+    Model/Table of batch crawls - groups the crawl jobs of one batch request
+"""
+class CrawlBatch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    max_concurrency = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=utc_now)
+
+    jobs = db.relationship('CrawlJob', backref='batch', lazy=True)
+
+    def __repr__(self):
+        return f"<CrawlBatch {self.id}: {len(self.jobs)} jobs>"
+
+"""
+    Model/Table of MediaAsset - metadata and local copies of post media, shared by every report
+"""
+class MediaAsset(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(500), nullable=False, unique=True, index=True)
+    content_type = db.Column(db.String(100), nullable=True)
+    size = db.Column(db.Integer, nullable=True)
+    digest = db.Column(db.String(64), nullable=True, index=True) # sha256 of the content, names the files
+    filename = db.Column(db.String(200), nullable=True)
+    thumbnail = db.Column(db.String(200), nullable=True)
+    error = db.Column(db.String(500), nullable=True)
+    fetched_at = db.Column(db.DateTime, nullable=False, default=utc_now)
+
+    def __repr__(self):
+        return f"<MediaAsset {self.id}: {self.url} ({self.content_type}, {self.size} bytes)>"
+
+"""
+    Model/Table of SubredditDay - analytics rollup of the reports of a subreddit crawled on one day
+"""
+class SubredditDay(db.Model):
+    __table_args__ = (db.UniqueConstraint('subreddit', 'day', name='uq_subreddit_day'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    subreddit = db.Column(db.String(100), nullable=False)
+    day = db.Column(db.String(10), nullable=False) # YYYY-MM-DD of the report timestamps
+    reports = db.Column(db.Integer, nullable=False, default=0)
+    snapshots = db.Column(db.Integer, nullable=False, default=0) # Posts across the reports
+    score_total = db.Column(db.Integer, nullable=False, default=0)
+    comment_total = db.Column(db.Integer, nullable=False, default=0)
+    new_posts = db.Column(db.Integer, nullable=False, default=0) # Posts first crawled that day
+    image_posts = db.Column(db.Integer, nullable=False, default=0)
+    video_posts = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SubredditDay r/{self.subreddit} {self.day}: {self.reports} reports>"
+
+"""
+    Model/Table of SubredditHistogram - score and comment distribution buckets per subreddit and day
+"""
+class SubredditHistogram(db.Model):
+    __table_args__ = (db.UniqueConstraint('subreddit', 'day', 'metric', 'bucket', name='uq_subreddit_histogram'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    subreddit = db.Column(db.String(100), nullable=False)
+    day = db.Column(db.String(10), nullable=False)
+    metric = db.Column(db.String(20), nullable=False) # 'score' or 'comments'
+    bucket = db.Column(db.Integer, nullable=False)    # Lower bound, see analytics.BUCKET_BOUNDS
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SubredditHistogram r/{self.subreddit} {self.day} {self.metric}>={self.bucket}: {self.count}>"
+
+"""
+    Model/Table of SubredditAuthor - posts per author in a subreddit, for the top authors
+"""
+class SubredditAuthor(db.Model):
+    __table_args__ = (db.UniqueConstraint('subreddit', 'author', name='uq_subreddit_author'),
+                      db.Index('ix_subreddit_author_posts', 'subreddit', 'posts'))
+
+    id = db.Column(db.Integer, primary_key=True)
+    subreddit = db.Column(db.String(100), nullable=False)
+    author = db.Column(db.String(500), nullable=False)
+    posts = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SubredditAuthor r/{self.subreddit} {self.author}: {self.posts} posts>"
+
+"""
+    Model/Table of saved crawl definitions run by the scheduler
+"""
+class CrawlSchedule(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subreddit = db.Column(db.String(100), nullable=False)
+    sort = db.Column(db.String(100), nullable=False)
+    target_posts = db.Column(db.Integer, nullable=False)
+    recipients = db.Column(db.String(500), nullable=True) # Comma separated Telegram handles
+    cron = db.Column(db.String(100), nullable=False)
+    incremental = db.Column(db.Boolean, nullable=False, default=False)
+    enabled = db.Column(db.Boolean, nullable=False, default=True)
+    next_run_at = db.Column(db.DateTime, nullable=False, index=True)
+    last_run_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utc_now)
+
+    jobs = db.relationship('CrawlJob', backref='schedule', lazy=True)
+
+    @property
+    def recipient_handles(self):
+        return [handle.strip().strip('@') for handle in (self.recipients or '').split(',') if handle.strip()]
+
+    def to_dict(self):
+        return {
+            'id' : self.id,
+            'subreddit' : self.subreddit,
+            'sort' : self.sort,
+            'target_posts' : self.target_posts,
+            'recipients' : self.recipient_handles,
+            'cron' : self.cron,
+            'incremental' : self.incremental,
+            'enabled' : self.enabled,
+            'next_run_at' : self.next_run_at.isoformat() if self.next_run_at else None,
+            'last_run_at' : self.last_run_at.isoformat() if self.last_run_at else None
+        }
+
+    def __repr__(self):
+        return f"<CrawlSchedule {self.id}: r/{self.subreddit}/{self.sort} ({self.cron})>"
+
+# ----------------------------------------------------------------------------------------- #
+
+# Adds columns and indexes introduced after a table was first created, as create_all only creates new tables
+def migrate_database():
+    with db.engine.begin() as connection:
+        migrate_legacy_posts(connection)
+        repair_snapshot_foreign_keys(connection)
+        create_search_index(connection)
+
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                    print(f"Database migrated: added {table.name}.{column.name}")
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(bind=connection)
+                    print(f"Database migrated: added index {index.name}")
+
+    backfill_rollups()
+
+# Splits the old one-row-per-report-per-post table into canonical posts and per-report snapshots
+def migrate_legacy_posts(connection):
+    inspector = inspect(connection)
+    if not inspector.has_table('post'):
+        return
+    if 'report_id' not in {column['name'] for column in inspector.get_columns('post')}:
+        return
+
+    print("Database migrating: deduplicating posts into canonical posts and snapshots")
+    for index in inspector.get_indexes('post'):
+        connection.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+    # Legacy renaming leaves the foreign keys that name post alone, post_snapshot may have been
+    # created by create_all already and must keep pointing at the new post table
+    connection.execute(text('PRAGMA legacy_alter_table=ON'))
+    connection.execute(text('ALTER TABLE post RENAME TO post_legacy'))
+    connection.execute(text('PRAGMA legacy_alter_table=OFF'))
+    Post.__table__.create(bind=connection)
+    PostSnapshot.__table__.create(bind=connection, checkfirst=True)
+
+    # The newest row of each post wins for its links, title and media
+    connection.execute(text("""
+        INSERT OR IGNORE INTO post (unique_id, perma_link, href_content, post_title, post_author, media_content, first_seen, last_seen)
+        SELECT legacy.unique_id, legacy.perma_link, legacy.href_content, legacy.post_title, legacy.post_author,
+               legacy.media_content, seen.first_seen, seen.last_seen
+        FROM post_legacy AS legacy
+        JOIN (SELECT unique_id, MIN(timestamp) AS first_seen, MAX(timestamp) AS last_seen, MAX(id) AS latest_id
+              FROM post_legacy GROUP BY unique_id) AS seen ON seen.latest_id = legacy.id
+    """))
+    connection.execute(text("""
+        INSERT INTO post_snapshot (report_id, post_id, rank, post_score, comment_count, timestamp)
+        SELECT legacy.report_id, post.id,
+               ROW_NUMBER() OVER (PARTITION BY legacy.report_id ORDER BY legacy.id),
+               legacy.post_score, legacy.comment_count, legacy.timestamp
+        FROM post_legacy AS legacy JOIN post ON post.unique_id = legacy.unique_id
+    """))
+    connection.execute(text('DROP TABLE post_legacy'))
+    print("Database migrated: posts deduplicated, run VACUUM to reclaim the freed space")
+
+# Databases deduplicated before the rename above kept the foreign keys have a post_snapshot that
+# references the dropped post_legacy table, it is rebuilt with the current definition
+def repair_snapshot_foreign_keys(connection):
+    inspector = inspect(connection)
+    if not inspector.has_table('post_snapshot'):
+        return
+    if 'post_legacy' not in {key['referred_table'] for key in inspector.get_foreign_keys('post_snapshot')}:
+        return
+
+    for index in inspector.get_indexes('post_snapshot'):
+        connection.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+    connection.execute(text('ALTER TABLE post_snapshot RENAME TO post_snapshot_broken'))
+    PostSnapshot.__table__.create(bind=connection)
+    existing = {column['name'] for column in inspector.get_columns('post_snapshot')}
+    columns = ', '.join(column.name for column in PostSnapshot.__table__.columns if column.name in existing)
+    connection.execute(text(f'INSERT INTO post_snapshot ({columns}) SELECT {columns} FROM post_snapshot_broken'))
+    connection.execute(text('DROP TABLE post_snapshot_broken'))
+    print("Database migrated: post_snapshot foreign keys repaired")
+
+# Full-text index over post titles and authors, an external content FTS5 table over post.
+# store_report_posts indexes new posts in one statement per report (a trigger per inserted row
+# is several times slower), refreshed and deleted posts are kept in step by triggers
+SEARCH_INDEX_SQL = (
+    """CREATE VIRTUAL TABLE post_search USING fts5(
+           post_title, post_author, content='post', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER post_search_delete AFTER DELETE ON post BEGIN
+           INSERT INTO post_search (post_search, rowid, post_title, post_author)
+           VALUES ('delete', old.id, old.post_title, old.post_author);
+       END""",
+    # Only title and author changes touch the index, not the last_seen update of every crawl
+    """CREATE TRIGGER post_search_update AFTER UPDATE OF post_title, post_author ON post BEGIN
+           INSERT INTO post_search (post_search, rowid, post_title, post_author)
+           VALUES ('delete', old.id, old.post_title, old.post_author);
+           INSERT INTO post_search (rowid, post_title, post_author) VALUES (new.id, new.post_title, new.post_author);
+       END"""
+)
+
+# Creates the search index and fills it from the posts already stored
+def create_search_index(connection):
+    if connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'post_search'")).first():
+        return False
+    for statement in SEARCH_INDEX_SQL:
+        connection.execute(text(statement))
+    rebuild_search_index(connection)
+    print("Database migrated: built the post search index")
+    return True
+
+def rebuild_search_index(connection):
+    connection.execute(text("INSERT INTO post_search (post_search) VALUES ('rebuild')"))
+    connection.execute(text("INSERT INTO post_search (post_search) VALUES ('optimize')"))
+
 # ----------------------------------------------------------------------------------------- #
 
 # Telegram bot start command helper function - registers user if they have not been
-async def start_command(update: Update, context: CallbackContext) -> None:
+async def start_command(update: "Update", context: "CallbackContext") -> None:
     user = update.effective_user
     chat_id = str(update.effective_chat.id)
     handle = user.username
@@ -111,17 +462,38 @@ async def start_command(update: Update, context: CallbackContext) -> None:
         except Exception as e:
             print(f"ERROR: Unexpected error: unexpected error: {e}")
 
+# Runs the delivery sender on the bot application's event loop, the task is kept so it can be
+# cancelled and awaited when the bot shuts down
+async def start_telegram_sender(application):
+    application.bot_data['telegram_sender'] = asyncio.create_task(telegram_sender.run(application.bot))
+
+async def stop_telegram_sender(application):
+    task = application.bot_data.pop('telegram_sender', None)
+    if task:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"ERROR: Telegram sender stopped with an error: {e}")
+        print("Telegram delivery sender stopped")
+
 # Telegram bot poll threading - starts up when the application runs
 def bot_polling():
     if not token:
         print("ERROR: No token detected")
         return
 
+    from telegram.error import InvalidToken
+    from telegram.ext import ApplicationBuilder, CommandHandler
+
     try:
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
-        application = ApplicationBuilder().token(token).build()
+        application = (ApplicationBuilder().token(token)
+                       .post_init(start_telegram_sender).post_shutdown(stop_telegram_sender).build())
         application.add_handler(CommandHandler('start', start_command))
         loop.run_until_complete(application.run_polling())
         print("Telegram bot is now polling")
@@ -134,11 +506,150 @@ def bot_polling():
 # ----------------------------------------------------------------------------------------- #
 
 # Report directory
-report_directory = os.path.join(app.root_path, 'reports')
+report_directory = os.getenv('REPORT_DIRECTORY', os.path.join(app.root_path, 'reports'))
 os.makedirs(report_directory, exist_ok=True)
 
+# Raw page archive, CRAWL_ARCHIVE_PAGES=1 stores each crawl's pages so posts can be re-extracted
+archive_pages = os.getenv('CRAWL_ARCHIVE_PAGES', '0') == '1'
+archive_directory = os.getenv('PAGE_ARCHIVE_DIRECTORY', os.path.join(app.root_path, 'archive'))
+os.makedirs(archive_directory, exist_ok=True)
+
 all_reports = []
 
+# Media enrichment, post media is fetched once, thumbnailed and served from /media
+enrich_media = os.getenv('MEDIA_ENRICHMENT', '1') == '1'
+media_directory = os.getenv('MEDIA_DIRECTORY', os.path.join(app.root_path, 'media'))
+media_enricher = MediaEnricher(MediaStore(media_directory),
+                               workers = int(os.getenv('MEDIA_FETCH_CONCURRENCY', '8')),
+                               max_bytes = int(os.getenv('MEDIA_MAX_MB', '20')) * 1024 * 1024,
+                               thumbnail_size = int(os.getenv('MEDIA_THUMBNAIL_SIZE', '320')))
+
+# Crawls saved as reports within the cache ttl, so crawl worker processes reuse each other's
+# results. The reports of cached crawls are skipped, a result is only reused within its own ttl
+def stored_crawl(subreddit, sort, target_posts):
+    now = datetime.now(timezone.utc)
+    since = (now - timedelta(seconds=crawl_cache.ttl)).strftime('%Y-%m-%d-%H%M%S')
+    report = (Report.query
+              .filter(Report.subreddit == subreddit, Report.sort == sort, Report.timestamp >= since,
+                      Report.post_count >= target_posts, Report.cached_from.is_(None))
+              .order_by(Report.timestamp.desc(), Report.id.desc())
+              .first())
+    if not report:
+        return None
+
+    rows = (db.session.query(Post.unique_id, Post.perma_link, Post.href_content, Post.post_title, Post.post_author,
+                             Post.media_content, PostSnapshot.post_score, PostSnapshot.comment_count, PostSnapshot.timestamp)
+            .join(PostSnapshot, PostSnapshot.post_id == Post.id)
+            .filter(PostSnapshot.report_id == report.id)
+            .order_by(PostSnapshot.rank)
+            .all())
+    crawled_at = datetime.strptime(report.timestamp, '%Y-%m-%d-%H%M%S').replace(tzinfo=timezone.utc)
+    return CachedCrawl(
+        posts=[CrawledPost(**row._asdict()) for row in rows],
+        target_posts=report.post_count,
+        crawled_at=report.timestamp,
+        created=time.monotonic() - (now - crawled_at).total_seconds()
+    )
+
+# Recent crawl results, repeat requests for a subreddit within CRAWL_CACHE_TTL seconds reuse them
+crawl_cache = CrawlResultCache(ttl = float(os.getenv('CRAWL_CACHE_TTL', '300')), shared_lookup = stored_crawl)
+
+# Rendered report cache, reports are immutable after the crawl so repeat views skip rendering
+report_cache = ReportCache(max_bytes = int(os.getenv('REPORT_CACHE_MB', '64')) * 1024 * 1024)
+
+# Report listing page size
+REPORTS_PER_PAGE = 25
+
+def list_reports(cursor=None, subreddit=None, sort=None, limit=REPORTS_PER_PAGE):
+    """
+        Keyset pagination over reports, newest first. The cursor is the "timestamp:id" of the
+        last report on the previous page, so every page is an index range scan no matter how
+        many reports exist. Returns the page of reports and the cursor of the next page
+    """
+    query = db.session.query(Report.id, Report.timestamp, Report.subreddit,
+                             Report.sort, Report.post_count, Report.filename, Report.cached_from)
+    if subreddit:
+        query = query.filter(Report.subreddit == subreddit)
+    if sort:
+        query = query.filter(Report.sort == sort)
+    if cursor:
+        timestamp, _, report_id = cursor.rpartition(':')
+        query = query.filter(tuple_(Report.timestamp, Report.id) < tuple_(timestamp, int(report_id)))
+
+    rows = query.order_by(Report.timestamp.desc(), Report.id.desc()).limit(limit + 1).all()
+    report_list = [{
+        'id' : report.id,
+        'timestamp' : report.timestamp,
+        'subreddit' : report.subreddit,
+        'sort' : report.sort,
+        'post_count' : report.post_count,
+        'filename' : report.filename,
+        'cached_from' : report.cached_from
+    } for report in rows[:limit]]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = report_list[-1]
+        next_cursor = f"{last['timestamp']}:{last['id']}"
+    return report_list, next_cursor
+
+# Reads cursor, filters and page size from the query string
+def report_listing_args():
+    try:
+        limit = min(max(int(request.args.get('limit', REPORTS_PER_PAGE)), 1), 100)
+    except ValueError:
+        limit = REPORTS_PER_PAGE
+    return {
+        'cursor' : request.args.get('cursor') or None,
+        'subreddit' : request.args.get('subreddit', '').strip() or None,
+        'sort' : request.args.get('sort') or None,
+        'limit' : limit
+    }
+
+def report_time(value):
+    """
+        ISO date or datetime to the report timestamp format, so ranges compare as strings
+    """
+    return datetime.fromisoformat(value).strftime('%Y-%m-%d-%H%M%S') if value else None
+
+def search_posts(query, subreddit=None, since=None, until=None, limit=REPORTS_PER_PAGE, offset=0):
+    """
+        Posts whose title or author match an FTS5 query ("exact phrase", prefix*, OR, NOT,
+        post_author: name), best match first. subreddit, since and until keep posts crawled
+        by a matching report. Returns the page of posts and the offset of the next page
+    """
+    report_filters = []
+    if subreddit:
+        report_filters.append('report.subreddit = :subreddit')
+    if since:
+        report_filters.append('report.timestamp >= :since')
+    if until:
+        report_filters.append('report.timestamp < :until')
+    crawled_by = f"""AND EXISTS (SELECT 1 FROM post_snapshot JOIN report ON report.id = post_snapshot.report_id
+                                 WHERE post_snapshot.post_id = post.id AND {' AND '.join(report_filters)})"""
+
+    rows = db.session.execute(text(f"""
+        SELECT post.unique_id, post.post_title, post.post_author, post.perma_link, post.media_content,
+               post.first_seen, post.last_seen, bm25(post_search, 2.0, 1.0) AS rank
+        FROM post_search JOIN post ON post.id = post_search.rowid
+        WHERE post_search MATCH :query {crawled_by if report_filters else ''}
+        ORDER BY rank
+        LIMIT :limit OFFSET :offset
+    """), {'query': query, 'subreddit': subreddit, 'since': since, 'until': until,
+           'limit': limit + 1, 'offset': offset}).mappings().all()
+
+    posts = [{
+        'unique_id' : row['unique_id'],
+        'post_title' : row['post_title'],
+        'post_author' : row['post_author'],
+        'perma_link' : row['perma_link'],
+        'media_content' : row['media_content'],
+        'first_seen' : row['first_seen'],
+        'last_seen' : row['last_seen'],
+        'score' : -row['rank'] # bm25 is lower for better matches, title matches weigh double
+    } for row in rows[:limit]]
+    return posts, offset + limit if len(rows) > limit else None
+
 """
     Routes for html pages
 """
@@ -147,33 +658,96 @@ def index():
     """
         Main page
     """
+    listing = report_listing_args()
     try:
-        db_reports = Report.query.order_by(Report.timestamp.desc()).all()
-        report_list = [{
-            'id' : report.id,
-            'timestamp' : report.timestamp,
-            'subreddit' : report.subreddit,
-            'sort' : report.sort,
-            'post_count' : report.post_count,
-            'filename' : report.filename
-        } for report in db_reports]
-    except SQLAlchemyError as e:
+        report_list, next_cursor = list_reports(**listing)
+    except (SQLAlchemyError, ValueError) as e:
         print("Unable to fetch past reports from the SQLite Database")
-        report_list = []
+        report_list, next_cursor = [], None
+
+    try:
+        job_list = [job.to_dict() for job in CrawlJob.query.order_by(CrawlJob.id.desc()).limit(10)]
+    except SQLAlchemyError as e:
+        print("Unable to fetch crawl jobs from the SQLite Database")
+        job_list = []
+
+    return render_template('main_page.html', reports = report_list, jobs = job_list,
+                           next_cursor = next_cursor, filters = listing)
 
-    return render_template('main_page.html', reports = report_list)
+# JSON variant of the report listing for dashboards
+@app.route('/api/reports')
+def api_reports():
+    try:
+        report_list, next_cursor = list_reports(**report_listing_args())
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({'reports': report_list, 'next_cursor': next_cursor})
+
+# Prometheus scrape endpoint - stage timings, post counters and errors for this process
+@app.route('/metrics')
+def metrics_endpoint():
+    return metrics.render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# Full-text search over the titles and authors of every crawled post
+@app.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', REPORTS_PER_PAGE)), 1), 100)
+        offset = max(int(request.args.get('offset', 0)), 0)
+        since, until = report_time(request.args.get('since')), report_time(request.args.get('until'))
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be numbers, since and until ISO dates'}), 400
+
+    try:
+        posts, next_offset = search_posts(query, request.args.get('subreddit', '').strip() or None,
+                                          since, until, limit, offset)
+    except OperationalError as e: # FTS5 rejects malformed queries, e.g. an unclosed quote
+        return jsonify({'error': f'Invalid search query: {e.orig}'}), 400
+    for post in posts:
+        post['history'] = url_for('post_history', unique_id=post['unique_id'])
+    return jsonify({'query': query, 'posts': posts, 'next_offset': next_offset})
+
+# Subreddit trends - top authors, score and comment distributions, media share and posts per day
+@app.route('/analytics')
+@app.route('/analytics/<subreddit>')
+def analytics(subreddit=None):
+    try:
+        args = analytics_args()
+    except ValueError:
+        args = {'since': None, 'until': None, 'authors': 10}
+    return render_template('analytics.html', summary = analytics_summary(), filters = args,
+                           trends = subreddit_analytics(subreddit, **args) if subreddit else None)
+
+@app.route('/api/analytics')
+@app.route('/api/analytics/<subreddit>')
+def api_analytics(subreddit=None):
+    if not subreddit:
+        return jsonify({'subreddits': analytics_summary()})
+    try:
+        args = analytics_args()
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO dates, authors a number'}), 400
+    return jsonify(subreddit_analytics(subreddit, **args))
 
 # ----------------------------------------------------------------------------------------- #
 
 @app.route('/crawl', methods=['POST'])
 async def crawl():
     """
-        Crawl page status
+        Queues a crawl job and returns straight away, a crawl worker picks it up
     """
     subreddit = request.form.get('subreddit', 'memes') # Getting settings from the form
     sort = request.form.get('sort', 'top')
     target_posts = request.form.get('target_posts', '20')
     user_handle = request.form.get('user_handle', '').strip()
+    browser_mode = request.form.get('browser_mode') or None
+
+    if browser_mode and browser_mode not in BROWSER_MODES:
+        print(f"ERROR: Unknown browser mode {browser_mode}")
+        return redirect(url_for('index'))
 
     try:
         target_posts = int(target_posts)
@@ -193,15 +767,65 @@ async def crawl():
             print("ERROR: User not found")
             return redirect(url_for('index'))
 
-    # Crawls subreddit with settings from the form
+    try:
+        job = CrawlJob(
+            subreddit = subreddit,
+            sort = sort,
+            target_posts = target_posts,
+            user_handle = registered.handle if registered else None,
+            browser_mode = browser_mode
+        )
+        db.session.add(job)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"ERROR: Unable to queue crawl job: {e}")
+        return redirect(url_for('index'))
+
+    crawl_workers.notify()
+    print(f"Queued crawl job {job.id} for r/{subreddit}/{sort}, {target_posts} posts.")
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(job.to_dict()), 202
+    return redirect(url_for('index'))
+
+# ----------------------------------------------------------------------------------------- #
+
+# Crawl job handler - crawls, saves, generates and sends the report, runs on a crawl worker
+def run_crawl_job(job, check_cancelled):
+    subreddit = job.subreddit
+    sort = job.sort
+    target_posts = job.target_posts
+
+    # Incremental scheduled crawls of new posts stop at the posts stored by the previous runs
+    stop_at = None
+    if job.schedule and job.schedule.incremental and sort == 'new':
+        stop_at = previous_crawl_ids(job.schedule_id)
+
+    # Crawls subreddit with settings from the job
     print(f"Crawling r/{subreddit}/{sort} for {target_posts} posts.")
-    crawled_posts = crawl_subreddit(subreddit, sort, target_posts)
-    if crawled_posts:
+    # Incremental crawls depend on the schedule's history so they always crawl
+    snapshots = [] if archive_pages else None
+    cached = None
+    if stop_at: # Errors are raised so a failed crawl fails the job instead of reading as no new posts
+        crawled_posts = crawl_subreddit(subreddit, sort, target_posts, stop_at=stop_at, snapshots=snapshots,
+                                        browser_mode=job.browser_mode, raise_errors=True)
+    else:
+        crawled_posts, cached = crawl_cache.get_or_crawl(
+            subreddit, sort, target_posts,
+            lambda: crawl_subreddit(subreddit, sort, target_posts, snapshots=snapshots,
+                                    browser_mode=job.browser_mode))
+    if cached:
+        print(f"Using {len(crawled_posts)} posts of r/{subreddit}/{sort} crawled at {cached.crawled_at}")
+    elif crawled_posts:
         print(f'Successfully Crawled {len(crawled_posts)} posts from {subreddit}/{sort}')
+    elif stop_at:
+        print(f"No new posts in {subreddit}/{sort} since the previous crawl")
+        return None
     else:
-        print(f"ERROR: Failed to crawl {subreddit}/{sort}")
-        return redirect(url_for('index'))
+        raise RuntimeError(f"Failed to crawl {subreddit}/{sort}")
     top_posts = crawled_posts[:target_posts]
+    check_cancelled()
 
     # Report variables
     report_timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d-%H%M%S')
@@ -210,76 +834,605 @@ async def crawl():
 
     # Pushing new data to SQLite Database
     try:
+        new_report = save_report(subreddit, sort, top_posts, report_file,
+                                 cached_from = cached.crawled_at if cached else None)
+        print("Successfully pushed to SQLite database")
+        print(f"Contents: {new_report.post_count} posts under report number {new_report.id}")
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        metrics.errors.inc(stage='db_commit', type=type(e).__name__)
+        print(f"ERROR: Unable to save to the SQLite database: {e}")
+        raise
+
+    # Archiving the raw pages, a failure here only loses the archive and not the report
+    if snapshots:
+        try:
+            new_report.snapshot_file = write_snapshot(archive_directory, report_file, snapshots)
+            db.session.commit()
+        except (OSError, SQLAlchemyError) as e:
+            db.session.rollback()
+            metrics.errors.inc(stage='archive', type=type(e).__name__)
+            print(f"WARNING: Unable to archive the pages of report {new_report.id}: {e}")
+
+    # Fetching media metadata and thumbnails, reports fall back to the remote media without them
+    if enrich_media:
+        try:
+            enrich_report_media(new_report)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            metrics.errors.inc(stage='media_enrichment', type=type(e).__name__)
+            print(f"WARNING: Unable to save the media of report {new_report.id}: {e}")
+
+    # The report is saved, so nothing below fails the job - a retry would crawl and save it again
+
+    # Generating and saving HTML Report, the same file is served by view_report and is
+    # generated again on the first view or Telegram upload when it is missing
+    try:
+        generate_html(new_report.id)
+    except Exception as e:
+        metrics.errors.inc(stage='render', type=type(e).__name__)
+        print(f"WARNING: Unable to generate the HTML of report {new_report.id}: {e}")
+
+    # Queues the report for the job's handle and the schedule's recipients
+    handles = [job.user_handle] if job.user_handle else []
+    if job.schedule:
+        handles += job.schedule.recipient_handles
+    if handles:
+        try:
+            queue_report_delivery(new_report, handles,
+                                  f"Here is the {target_posts} post PDF report for r/{subreddit}/{sort}")
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            metrics.errors.inc(stage='delivery', type=type(e).__name__)
+            print(f"ERROR: Unable to queue report {new_report.id} for Telegram delivery: {e}")
+
+    print(f'Crawled, Saved, Generated and Sent(?) report!')
+    return new_report.id
+
+# Post ids stored by the last few reports of a schedule, where an incremental crawl can stop,
+# before_report only looks at the reports that came before that one (for re-extraction)
+def previous_crawl_ids(schedule_id, reports = 3, before_report = None):
+    report_ids = (CrawlJob.query.with_entities(CrawlJob.report_id)
+                  .filter(CrawlJob.schedule_id == schedule_id, CrawlJob.report_id.isnot(None)))
+    if before_report is not None:
+        report_ids = report_ids.filter(CrawlJob.report_id < before_report)
+    report_ids = report_ids.order_by(CrawlJob.id.desc()).limit(reports)
+    rows = (db.session.query(Post.unique_id)
+            .join(PostSnapshot, PostSnapshot.post_id == Post.id)
+            .filter(PostSnapshot.report_id.in_(report_ids))
+            .all())
+    return {unique_id for (unique_id,) in rows}
+
+# Saves a report and all of its posts in one transaction
+def save_report(subreddit, sort, posts, report_file, cached_from = None):
+    with metrics.stage_seconds.time(stage='db_commit'):
         new_report = Report( # New Report
             timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d-%H%M%S'),
             subreddit = subreddit,
             sort = sort,
-            post_count = len(top_posts),
-            filename = report_file
+            post_count = len(posts),
+            filename = report_file,
+            cached_from = cached_from,
+            rolled_up = True
         )
         db.session.add(new_report)
         db.session.flush()
+        new_posts = store_report_posts(new_report, posts)
+        apply_rollup(new_report, rollup_report(
+            [(post.post_score, post.comment_count) for post in posts],
+            [(post.post_author, post.media_content) for post in new_posts]))
+        db.session.commit()
+    return new_report
+
+# Posts are upserted into the canonical post table and the report gets one bulk inserted
+# snapshot row per post. refresh also overwrites the stored post fields, for re-extraction.
+# Returns the posts no earlier report had stored
+def store_report_posts(report, posts, refresh = False):
+    if not posts:
+        return []
+    newest_post_id = db.session.scalar(select(func.max(Post.id))) or 0 # Posts above it are new
+    upsert = sqlite_insert(Post)
+    updated = {'last_seen': upsert.excluded.last_seen}
+    if refresh:
+        updated = {name: upsert.excluded[name] for name in
+                   ('perma_link', 'href_content', 'post_title', 'post_author', 'media_content')}
+    db.session.execute(upsert.on_conflict_do_update(
+        index_elements=[Post.unique_id],
+        set_=updated
+    ), [{
+        'unique_id' : post.unique_id,
+        'perma_link' : post.perma_link,
+        'href_content' : post.href_content,
+        'post_title' : post.post_title,
+        'post_author' : post.post_author,
+        'media_content' : post.media_content,
+        'first_seen' : post.timestamp,
+        'last_seen' : post.timestamp
+    } for post in posts])
+    db.session.execute(text("""
+        INSERT INTO post_search (rowid, post_title, post_author)
+        SELECT id, post_title, post_author FROM post WHERE id > :newest_post_id
+    """), {'newest_post_id': newest_post_id})
+
+    post_ids = dict(db.session.execute(
+        select(Post.unique_id, Post.id).where(Post.unique_id.in_([post.unique_id for post in posts]))
+    ).all())
+    db.session.execute(insert(PostSnapshot), [{
+        'report_id' : report.id,
+        'post_id' : post_ids[post.unique_id],
+        'rank' : rank,
+        'post_score' : post.post_score,
+        'comment_count' : post.comment_count,
+        'timestamp' : post.timestamp
+    } for rank, post in enumerate(posts, start=1)])
+    return [post for post in posts if post_ids[post.unique_id] > newest_post_id]
+
+# Fetches the media of a report's posts that no earlier report has fetched. Media that could
+# not be reached is not stored, so the next crawl that sees it tries again
+def enrich_report_media(report):
+    urls = {url for (url,) in db.session.query(Post.media_content)
+            .join(PostSnapshot, PostSnapshot.post_id == Post.id)
+            .filter(PostSnapshot.report_id == report.id, Post.media_content.isnot(None))}
+    known = {url for (url,) in db.session.query(MediaAsset.url).filter(MediaAsset.url.in_(urls))} if urls else set()
+    missing = sorted(urls - known)
+    if not missing:
+        return
 
-        for post in top_posts:
-            new_post = Post( # New Post
-                report_id = new_report.id,
-                unique_id = post.unique_id,
-                perma_link = post.perma_link,
-                href_content = post.href_content,
-                comment_count = post.comment_count,
-                post_title = post.post_title,
-                post_author = post.post_author,
-                post_score = post.post_score,
-                media_content = post.media_content,
-                timestamp = post.timestamp
-            )
-            db.session.add(new_post)
+    with metrics.stage_seconds.time(stage='media_enrichment'):
+        media = media_enricher.enrich(missing)
+    fetched = [info for info in media if info.content_type]
+    if fetched:
+        db.session.execute(sqlite_insert(MediaAsset).on_conflict_do_nothing(index_elements=[MediaAsset.url]), [{
+            'url' : info.url,
+            'content_type' : info.content_type,
+            'size' : info.size,
+            'digest' : info.digest,
+            'filename' : info.filename,
+            'thumbnail' : info.thumbnail,
+            'error' : info.error,
+            'fetched_at' : utc_now()
+        } for info in fetched])
+        db.session.commit()
+    print(f"Enriched {len(fetched)}/{len(missing)} media urls, "
+          f"{sum(1 for info in fetched if info.thumbnail)} thumbnails")
+
+# Canonical posts no report has a snapshot of any more are removed
+def remove_orphaned_posts(post_ids):
+    if post_ids:
+        db.session.execute(delete(Post).where(
+            Post.id.in_(post_ids),
+            ~exists().where(PostSnapshot.post_id == Post.id)
+        ))
+
+# ----------------------------------------------------------------------------------------- #
+
+# SubredditDay counters, named as the ReportRollup fields they are added from
+ROLLUP_COUNTERS = ('reports', 'snapshots', 'score_total', 'comment_total', 'new_posts', 'image_posts', 'video_posts')
+
+# Rollup upserts, prepared once as they run with every saved report
+ROLLUP_DAY_UPSERT = text(f"""
+    INSERT INTO subreddit_day (subreddit, day, {', '.join(ROLLUP_COUNTERS)})
+    VALUES (:subreddit, :day, {', '.join(':' + name for name in ROLLUP_COUNTERS)})
+    ON CONFLICT (subreddit, day) DO UPDATE SET
+    {', '.join(f'{name} = {name} + excluded.{name}' for name in ROLLUP_COUNTERS)}
+""")
+ROLLUP_HISTOGRAM_UPSERT = text("""
+    INSERT INTO subreddit_histogram (subreddit, day, metric, bucket, count)
+    VALUES (:subreddit, :day, :metric, :bucket, :count)
+    ON CONFLICT (subreddit, day, metric, bucket) DO UPDATE SET count = count + excluded.count
+""")
+ROLLUP_AUTHOR_UPSERT = text("""
+    INSERT INTO subreddit_author (subreddit, author, posts) VALUES (:subreddit, :author, :posts)
+    ON CONFLICT (subreddit, author) DO UPDATE SET posts = posts + excluded.posts
+""")
+
+# Adds a report's rollup to its subreddit's analytics for the day, or takes it away with sign -1
+def apply_rollup(report, rollup, sign = 1):
+    day = report.timestamp[:10]
+    db.session.execute(ROLLUP_DAY_UPSERT, {'subreddit': report.subreddit, 'day': day,
+                                           **{name: sign * getattr(rollup, name) for name in ROLLUP_COUNTERS}})
+
+    buckets = [{'subreddit': report.subreddit, 'day': day, 'metric': metric, 'bucket': lower, 'count': sign * count}
+               for metric, counts in (('score', rollup.score_buckets), ('comments', rollup.comment_buckets))
+               for lower, count in counts.items()]
+    if buckets:
+        db.session.execute(ROLLUP_HISTOGRAM_UPSERT, buckets)
+
+    if rollup.authors:
+        db.session.execute(ROLLUP_AUTHOR_UPSERT, [{'subreddit': report.subreddit, 'author': author, 'posts': sign * count}
+                                                  for author, count in rollup.authors.items()])
+
+    if sign < 0: # Rows taken down to nothing are removed
+        db.session.execute(delete(SubredditDay).where(
+            SubredditDay.subreddit == report.subreddit, SubredditDay.day == day, SubredditDay.reports <= 0))
+        db.session.execute(delete(SubredditHistogram).where(
+            SubredditHistogram.subreddit == report.subreddit, SubredditHistogram.day == day, SubredditHistogram.count <= 0))
+        db.session.execute(delete(SubredditAuthor).where(
+            SubredditAuthor.subreddit == report.subreddit, SubredditAuthor.posts <= 0))
+
+# Rollup of a stored report, its new posts are those no report with a lower id has a snapshot of
+def stored_report_rollup(report):
+    earlier = aliased(PostSnapshot)
+    snapshots = db.session.execute(
+        select(PostSnapshot.post_score, PostSnapshot.comment_count).where(PostSnapshot.report_id == report.id))
+    new_posts = db.session.execute(
+        select(Post.post_author, Post.media_content)
+        .join(PostSnapshot, PostSnapshot.post_id == Post.id)
+        .where(PostSnapshot.report_id == report.id,
+               ~exists().where(earlier.post_id == Post.id, earlier.report_id < report.id)))
+    return rollup_report(snapshots, new_posts)
+
+# Takes a report about to be deleted out of the analytics. Posts it crawled first that later
+# reports also crawled become new posts of the next of those reports
+def remove_report_rollup(report):
+    if not report.rolled_up: # Nothing to take away, and the reports after it are rolled up on their own
+        return
+    apply_rollup(report, stored_report_rollup(report), sign=-1)
+
+    earlier, later = aliased(PostSnapshot), aliased(PostSnapshot)
+    surviving = db.session.execute(
+        select(func.min(later.report_id), Post.post_author, Post.media_content)
+        .join(PostSnapshot, PostSnapshot.post_id == Post.id)
+        .join(later, (later.post_id == Post.id) & (later.report_id > report.id))
+        .where(PostSnapshot.report_id == report.id,
+               ~exists().where(earlier.post_id == Post.id, earlier.report_id < report.id))
+        .group_by(Post.id))
+    next_reports = {}
+    for next_report_id, author, media_content in surviving:
+        next_reports.setdefault(next_report_id, []).append((author, media_content))
+    for next_report_id, new_posts in next_reports.items():
+        next_report = db.session.get(Report, next_report_id)
+        if next_report.rolled_up:
+            apply_rollup(next_report, rollup_report([], new_posts, reports=0))
+
+# Recomputes every rollup from the stored reports, committing every 100 reports so crawls
+# saving reports meanwhile are not locked out for the whole rebuild
+def rebuild_rollups():
+    for model in (SubredditDay, SubredditHistogram, SubredditAuthor):
+        db.session.execute(delete(model))
+    report_ids = db.session.scalars(select(Report.id).order_by(Report.id)).all()
+    for number, report_id in enumerate(report_ids, start=1):
+        report = db.session.get(Report, report_id)
+        if report:
+            apply_rollup(report, stored_report_rollup(report))
+            report.rolled_up = True
+        if number % 100 == 0:
+            db.session.commit()
+            db.session.expunge_all()
+    db.session.commit()
+    return len(report_ids)
+
+# Reports stored before the analytics rollups existed are counted in once. Every rollup is rebuilt,
+# as which posts are new to a report depends on all the reports before it
+def backfill_rollups():
+    if not db.session.scalar(select(exists().where(Report.rolled_up.isnot(True)))):
+        return False
+    print(f"Database migrated: analytics rolled up from {rebuild_rollups()} reports")
+    return True
+
+def analytics_day(value):
+    return datetime.fromisoformat(value).strftime('%Y-%m-%d') if value else None
+
+# Subreddits with analytics and their totals, newest crawl first
+def analytics_summary():
+    rows = (db.session.query(SubredditDay.subreddit, func.sum(SubredditDay.reports), func.sum(SubredditDay.new_posts),
+                             func.min(SubredditDay.day), func.max(SubredditDay.day))
+            .group_by(SubredditDay.subreddit)
+            .order_by(func.max(SubredditDay.day).desc(), SubredditDay.subreddit)
+            .all())
+    return [{
+        'subreddit' : subreddit,
+        'reports' : reports,
+        'posts' : posts,
+        'first_day' : first_day,
+        'last_day' : last_day
+    } for subreddit, reports, posts, first_day, last_day in rows]
+
+# Trends of one subreddit, read only from the rollups so the cost does not grow with stored posts.
+# since is inclusive and until exclusive, both YYYY-MM-DD
+def subreddit_analytics(subreddit, since = None, until = None, authors = 10):
+    day_filters = [SubredditDay.subreddit == subreddit]
+    histogram_filters = [SubredditHistogram.subreddit == subreddit]
+    if since:
+        day_filters.append(SubredditDay.day >= since)
+        histogram_filters.append(SubredditHistogram.day >= since)
+    if until:
+        day_filters.append(SubredditDay.day < until)
+        histogram_filters.append(SubredditHistogram.day < until)
+
+    days = SubredditDay.query.filter(*day_filters).order_by(SubredditDay.day).all()
+    histogram = (db.session.query(SubredditHistogram.metric, SubredditHistogram.bucket, func.sum(SubredditHistogram.count))
+                 .filter(*histogram_filters)
+                 .group_by(SubredditHistogram.metric, SubredditHistogram.bucket)
+                 .order_by(SubredditHistogram.metric, SubredditHistogram.bucket)
+                 .all())
+    top_authors = (SubredditAuthor.query.filter_by(subreddit=subreddit)
+                   .order_by(SubredditAuthor.posts.desc(), SubredditAuthor.author)
+                   .limit(authors).all())
+
+    totals = {name: sum(getattr(day, name) for day in days) for name in
+              ('reports', 'snapshots', 'score_total', 'comment_total', 'new_posts', 'image_posts', 'video_posts')}
+    new_posts = totals['new_posts']
+    return {
+        'subreddit' : subreddit,
+        'since' : since,
+        'until' : until,
+        'totals' : totals,
+        'average_score' : totals['score_total'] / totals['snapshots'] if totals['snapshots'] else None,
+        'average_comments' : totals['comment_total'] / totals['snapshots'] if totals['snapshots'] else None,
+        'media_share' : {
+            'image' : totals['image_posts'] / new_posts if new_posts else None,
+            'video' : totals['video_posts'] / new_posts if new_posts else None,
+            'none' : (new_posts - totals['image_posts'] - totals['video_posts']) / new_posts if new_posts else None
+        },
+        'posts_per_day' : [{
+            'day' : day.day,
+            'reports' : day.reports,
+            'new_posts' : day.new_posts,
+            'snapshots' : day.snapshots,
+            'average_score' : day.score_total / day.snapshots if day.snapshots else None,
+            'average_comments' : day.comment_total / day.snapshots if day.snapshots else None
+        } for day in days],
+        'score_distribution' : [{'bucket': bucket_label(lower), 'count': count}
+                                for metric, lower, count in histogram if metric == 'score'],
+        'comment_distribution' : [{'bucket': bucket_label(lower), 'count': count}
+                                  for metric, lower, count in histogram if metric == 'comments'],
+        'top_authors' : [{'author': author.author, 'posts': author.posts} for author in top_authors]
+    }
+
+# Reads the date range and author count of an analytics request
+def analytics_args():
+    return {
+        'since' : analytics_day(request.args.get('since')),
+        'until' : analytics_day(request.args.get('until')),
+        'authors' : min(max(int(request.args.get('authors', 10)), 1), 100)
+    }
+
+# ----------------------------------------------------------------------------------------- #
+
+# Queues one delivery per registered handle, the bot process's sender does the sending
+def queue_report_delivery(report, handles, caption):
+    handles = list(dict.fromkeys(handle.strip().strip('@') for handle in handles if handle.strip()))
+    users = TelegramUser.query.filter(TelegramUser.handle.in_(handles)).all() if handles else []
+    chat_ids = list(dict.fromkeys(user.chat_id for user in users))
+    for chat_id in chat_ids:
+        db.session.add(TelegramDelivery(report_id=report.id, chat_id=chat_id, caption=caption))
+    db.session.commit()
+    telegram_sender.notify()
+
+    missing = set(handles) - {user.handle for user in users}
+    if missing:
+        print(f"WARNING: Not registered with the bot: {', '.join(sorted(missing))}")
+    print(f"Queued report {report.id} for {len(chat_ids)} Telegram chats")
+    return len(chat_ids)
+
+# Path of a report's file, generating it first if it is missing
+def ensure_report_file(report):
+    report_path = os.path.join(report_directory, report.filename)
+    if not os.path.exists(report_path):
+        generate_html(report.id)
+    return report_path
+
+telegram_sender = TelegramSender(app, db, TelegramDelivery, Report, ensure_report_file,
+                                 rate_limiter = TelegramRateLimiter(
+                                     messages_per_second = float(os.getenv('TELEGRAM_RATE_LIMIT', '25')),
+                                     chat_interval = float(os.getenv('TELEGRAM_CHAT_INTERVAL', '1'))))
+
+# Holds back jobs whose batch already has max_concurrency crawls running
+def batch_has_capacity(job):
+    if not job.batch_id:
+        return True
+    running = CrawlJob.query.filter_by(batch_id=job.batch_id, status=RUNNING).count()
+    return running < job.batch.max_concurrency
+
+crawl_workers = JobWorkerPool(app, db, CrawlJob, run_crawl_job,
+                              workers = int(os.getenv('CRAWL_WORKERS', '2')),
+                              poll_interval = float(os.getenv('CRAWL_POLL_INTERVAL', '5')),
+                              can_run = batch_has_capacity)
+
+# Crawls that can run at once across the crawl processes (CRAWL_PROCESSES, set by launcher.py).
+# Each process runs CRAWL_WORKERS jobs, and a job waits for a browser from its mode's pool
+def crawl_capacity(browser_modes = (None,)):
+    browsers = sum(pool_size(mode) for mode in set(browser_modes))
+    return int(os.getenv('CRAWL_PROCESSES', '1')) * min(crawl_workers.workers, browsers)
+
+# Queues the crawl job of a due schedule
+def enqueue_scheduled_crawl(schedule):
+    db.session.add(CrawlJob(
+        subreddit = schedule.subreddit,
+        sort = schedule.sort,
+        target_posts = schedule.target_posts,
+        schedule_id = schedule.id
+    ))
+    db.session.commit()
+    crawl_workers.notify()
+
+crawl_scheduler = CrawlScheduler(app, db, CrawlSchedule, enqueue_scheduled_crawl)
+
+# ----------------------------------------------------------------------------------------- #
+
+# Crawl job status, cancellation and manual retry
+@app.route('/jobs/<int:job_id>')
+async def job_status(job_id):
+    job = CrawlJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+async def cancel_job(job_id):
+    job = CrawlJob.query.get_or_404(job_id)
+    if job.status == QUEUED:
+        job.status = CANCELLED # Never claimed, so nothing else to stop
+    elif job.status == RUNNING:
+        job.cancel_requested = True # Worker stops before saving the report
+    job.updated_at = utc_now()
+    db.session.commit()
+    print(f"Cancellation requested for crawl job {job_id}")
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<int:job_id>/retry', methods=['POST'])
+async def retry_job(job_id):
+    job = CrawlJob.query.get_or_404(job_id)
+    if job.status in (FAILED, CANCELLED):
+        job.status = QUEUED
+        job.attempts = 0
+        job.cancel_requested = False
+        job.run_after = utc_now()
+        job.updated_at = utc_now()
+        db.session.commit()
+        crawl_workers.notify()
+        print(f"Crawl job {job_id} re-queued")
+    return jsonify(job.to_dict())
+
+# ----------------------------------------------------------------------------------------- #
+
+# Saved crawl schedules - JSON {"subreddit", "sort", "target_posts", "cron", "recipients", "incremental"}
+@app.route('/schedules', methods=['GET', 'POST'])
+async def schedules():
+    if request.method == 'GET':
+        return jsonify([schedule.to_dict() for schedule in CrawlSchedule.query.order_by(CrawlSchedule.id)])
+
+    payload = request.get_json(silent=True) or {}
+    try:
+        target_posts = int(payload.get('target_posts', 20))
+        if not(3 <= target_posts <= 100):
+            return jsonify({'error': 'target_posts must be between 3 and 100'}), 400
+        cron = CronSchedule(payload.get('cron') or '@hourly')
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid schedule: {e}'}), 400
+
+    recipients = payload.get('recipients') or []
+    if isinstance(recipients, str):
+        recipients = recipients.split(',')
+    recipients = [handle.strip().strip('@') for handle in recipients if handle.strip()]
+    for handle in recipients:
+        if not TelegramUser.query.filter_by(handle=handle).first():
+            return jsonify({'error': f'User not found: {handle}'}), 400
+
+    try:
+        schedule = CrawlSchedule(
+            subreddit = payload.get('subreddit') or 'memes',
+            sort = payload.get('sort') or 'new',
+            target_posts = target_posts,
+            recipients = ','.join(recipients) or None,
+            cron = cron.expression,
+            incremental = bool(payload.get('incremental', False)),
+            next_run_at = cron.next_after(utc_now())
+        )
+        db.session.add(schedule)
         db.session.commit()
-        print("Successfully pushed to SQLite database")
-        print(f"Contents: {new_report.post_count} posts under report number {new_report.id}")
     except SQLAlchemyError as e:
         db.session.rollback()
-        print(f"ERROR: Unable to save to the SQLite database: {e}")
+        print(f"ERROR: Unable to save schedule: {e}")
+        return jsonify({'error': 'Database error'}), 500
+
+    print(f"Saved schedule {schedule.id} for r/{schedule.subreddit}/{schedule.sort} ({schedule.cron})")
+    return jsonify(schedule.to_dict()), 201
+
+@app.route('/schedules/<int:schedule_id>', methods=['GET', 'PATCH', 'DELETE'])
+async def schedule_detail(schedule_id):
+    schedule = CrawlSchedule.query.get_or_404(schedule_id)
+    if request.method == 'DELETE':
+        CrawlJob.query.filter_by(schedule_id=schedule_id).update({'schedule_id': None})
+        db.session.delete(schedule)
+        db.session.commit()
+        print(f"Schedule {schedule_id} deleted")
+        return jsonify({'deleted': schedule_id})
+
+    if request.method == 'PATCH': # Enable or disable a schedule
+        payload = request.get_json(silent=True) or {}
+        if 'enabled' in payload:
+            schedule.enabled = bool(payload['enabled'])
+            if schedule.enabled:
+                schedule.next_run_at = CronSchedule(schedule.cron).next_after(utc_now())
+        db.session.commit()
+    return jsonify(schedule.to_dict())
 
-    # Generating and saving HTML Report
-    print(f"Generating HTML Report for {subreddit}/{sort}, {target_posts} posts")
-    html = render_template( # HTML that passes data into the template
-        'html_report.html',
-        posts = top_posts,
-        subreddit = subreddit,
-        sort = sort,
-        target_posts = target_posts)
+# ----------------------------------------------------------------------------------------- #
 
-    try:
-        with open(report_path, 'w', encoding='utf-8') as f:
-            f.write(html)
-        print(f"DEBUG: Report successfully written to file: {report_path}")
-    except IOError as e:
-        print(f'ERROR: Failed to save {report_file}', 'error')
-    except Exception as e:
-        print(f'ERROR: Unexcepted error while saving', 'error')
+# Batch crawl - queues one crawl job per subreddit, each producing its own report
+@app.route('/crawl_batch', methods=['POST'])
+async def batch_crawl():
+    """
+        Takes JSON {"crawls": [{"subreddit", "sort", "target_posts", "browser_mode"}, ...], "max_concurrency", "user_handle"}
+    """
+    payload = request.get_json(silent=True) or {}
+    crawls = payload.get('crawls') or []
+    user_handle = (payload.get('user_handle') or '').strip().strip('@')
 
-    # Handles sending the report if handle is provided
-    if registered and telegram_bot:
-        try:
-            if os.path.exists(report_path):
-                with open(report_path, 'r', encoding='utf-8') as f:
-                    await telegram_bot.send_document(
-                        chat_id = registered.chat_id,
-                        document = f,
-                        filename = os.path.basename(report_file),
-                        caption = f"Here is the {target_posts} post PDF report for r/{subreddit}/{sort}"
-                    )
-                print(f'Sent {report_file} successfully to {user_handle}')
-            else:
-                print(f'ERROR: Failed to send {report_file} to {user_handle}')
-        except TelegramError as e:
-            print(f'ERROR: Telegram API Error: {e}')
-        except Exception as e:
-            print(f'ERROR: Unexcepted error while sending: {e}')
+    if not crawls:
+        return jsonify({'error': 'No crawls given'}), 400
 
-    print(f'Crawled, Saved, Generated and Sent(?) report!')
-    return redirect(url_for('index'))
+    try:
+        crawl_settings = []
+        for entry in crawls:
+            target_posts = int(entry.get('target_posts', 20))
+            if not(3 <= target_posts <= 100):
+                return jsonify({'error': f"target_posts must be between 3 and 100: {entry}"}), 400
+            browser_mode = entry.get('browser_mode') or None
+            if browser_mode and browser_mode not in BROWSER_MODES:
+                return jsonify({'error': f"browser_mode must be one of {', '.join(BROWSER_MODES)}: {entry}"}), 400
+            crawl_settings.append((entry.get('subreddit') or 'memes', entry.get('sort') or 'top', target_posts, browser_mode))
+        max_concurrency = int(payload.get('max_concurrency') or os.getenv('CRAWL_BATCH_CONCURRENCY', '4'))
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({'error': 'Invalid crawl settings'}), 400
+
+    if user_handle and not TelegramUser.query.filter_by(handle=user_handle).first():
+        return jsonify({'error': 'User not found'}), 400
+
+    # Higher limits would only queue crawls behind the workers and browsers there are
+    capacity = crawl_capacity([browser_mode for *_, browser_mode in crawl_settings])
+
+    try:
+        batch = CrawlBatch(max_concurrency = max(1, min(max_concurrency, capacity)))
+        db.session.add(batch)
+        db.session.flush()
+        for subreddit, sort, target_posts, browser_mode in crawl_settings:
+            db.session.add(CrawlJob(
+                subreddit = subreddit,
+                sort = sort,
+                target_posts = target_posts,
+                user_handle = user_handle or None,
+                browser_mode = browser_mode,
+                batch_id = batch.id
+            ))
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"ERROR: Unable to queue batch crawl: {e}")
+        return jsonify({'error': 'Database error'}), 500
+
+    crawl_workers.notify()
+    print(f"Queued batch {batch.id} of {len(crawl_settings)} crawls, {batch.max_concurrency} at a time "
+          f"({max_concurrency} asked, {capacity} can run at once)")
+    return jsonify(batch_summary(batch)), 202
+
+# Batch summary - job states and the reports produced so far
+@app.route('/batches/<int:batch_id>')
+async def batch_status(batch_id):
+    batch = CrawlBatch.query.get_or_404(batch_id)
+    return jsonify(batch_summary(batch))
+
+def batch_summary(batch):
+    jobs = CrawlJob.query.filter_by(batch_id=batch.id).order_by(CrawlJob.id).all()
+    report_ids = [job.report_id for job in jobs if job.report_id]
+    posts = (db.session.query(func.coalesce(func.sum(Report.post_count), 0))
+             .filter(Report.id.in_(report_ids)).scalar()) if report_ids else 0
+
+    status_counts = {}
+    for job in jobs:
+        status_counts[job.status] = status_counts.get(job.status, 0) + 1
+
+    return {
+        'id' : batch.id,
+        'max_concurrency' : batch.max_concurrency,
+        'created_at' : batch.created_at.isoformat(),
+        'total' : len(jobs),
+        'statuses' : status_counts,
+        'finished' : all(job.status in (SUCCEEDED, FAILED, CANCELLED) for job in jobs),
+        'report_ids' : report_ids,
+        'post_count' : posts,
+        'jobs' : [job.to_dict() for job in jobs]
+    }
 
 # ----------------------------------------------------------------------------------------- #
 
@@ -287,25 +1440,38 @@ async def crawl():
 @app.route('/report/<path:filename>')
 async def report(filename):
     return send_from_directory(report_directory, filename)
+
+# Stored media and thumbnails, names are content hashes so they can be cached forever
+@app.route('/media/<path:filename>')
+async def media_file(filename):
+    return send_from_directory(media_directory, filename, max_age=365 * 24 * 3600)
 # ----------------------------------------------------------------------------------------- #
 
+# Posts of a report joined with their snapshot, sorted based on the report's sorting setting
+def load_report_posts(report):
+    order = PostSnapshot.timestamp.desc() if report.sort == 'new' else PostSnapshot.post_score.desc()
+    return (db.session.query(
+                Post.unique_id, Post.perma_link, Post.href_content, Post.post_title, Post.post_author,
+                Post.media_content, PostSnapshot.post_score, PostSnapshot.comment_count,
+                PostSnapshot.rank, PostSnapshot.timestamp,
+                MediaAsset.content_type.label('media_type'), MediaAsset.filename.label('media_file'),
+                MediaAsset.thumbnail.label('media_thumbnail'))
+            .join(PostSnapshot, PostSnapshot.post_id == Post.id)
+            .outerjoin(MediaAsset, MediaAsset.url == Post.media_content)
+            .filter(PostSnapshot.report_id == report.id)
+            .order_by(order, PostSnapshot.rank)
+            .all())
+
 # Fetches report using report id and renders it dynamically
 @app.route('/view_report/<int:report_id>')
 async def view_report(report_id):
     try:
         get_report = Report.query.get_or_404(report_id)
-        report_posts = Post.query.filter_by(report_id=report_id).all()
-
-        # Reports are sorted based on sorting setting
-        if get_report.sort == 'new':report_posts.sort(key=lambda p: p.timestamp, reverse=True)
-        else: report_posts.sort(key=lambda p: p.post_score, reverse=True)
-
-        print(f"Report {report_id} successfully fetched, now being rendered")
-        return render_template('html_report.html',
-                               posts = report_posts,
-                               subreddit = get_report.subreddit,
-                               sort = get_report.sort,
-                               target_posts = get_report.post_count)
+        report_path = os.path.join(report_directory, get_report.filename)
+        cached = report_cache.get(report_id, report_path, lambda: generate_html(report_id))
+
+        print(f"Report {report_id} successfully fetched")
+        return cached_report_response(cached, request)
     except SQLAlchemyError as e:
         print(f"ERROR: Database error: {e}")
         return redirect(url_for('index'))
@@ -315,13 +1481,109 @@ async def view_report(report_id):
 
 # ----------------------------------------------------------------------------------------- #
 
+# Score and comment history of a post across every report that crawled it
+@app.route('/posts/<unique_id>/history')
+async def post_history(unique_id):
+    post = Post.query.filter_by(unique_id=unique_id).first_or_404()
+    history = (db.session.query(PostSnapshot, Report)
+               .join(Report, Report.id == PostSnapshot.report_id)
+               .filter(PostSnapshot.post_id == post.id)
+               .order_by(PostSnapshot.timestamp)
+               .all())
+    return jsonify({
+        'unique_id' : post.unique_id,
+        'post_title' : post.post_title,
+        'post_author' : post.post_author,
+        'first_seen' : post.first_seen,
+        'last_seen' : post.last_seen,
+        'snapshots' : [{
+            'report_id' : report.id,
+            'subreddit' : report.subreddit,
+            'sort' : report.sort,
+            'rank' : snapshot.rank,
+            'post_score' : snapshot.post_score,
+            'comment_count' : snapshot.comment_count,
+            'timestamp' : snapshot.timestamp
+        } for snapshot, report in history]
+    })
+
+# ----------------------------------------------------------------------------------------- #
+
+# Rows per batch fetched from SQLite while exporting
+EXPORT_BATCH_ROWS = 1000
+
+def export_rows(report_id=None, subreddit=None, sort=None, since=None, until=None):
+    """
+        Post snapshots with their post and report, report by report in crawl order. Each report
+        is read in batches of EXPORT_BATCH_ROWS from an open cursor over the report_id index, so
+        neither this process nor SQLite holds the export in memory. since is inclusive and until
+        exclusive, both in the report timestamp format
+    """
+    reports = select(Report.id)
+    if report_id:
+        reports = reports.where(Report.id == report_id)
+    if subreddit:
+        reports = reports.where(Report.subreddit == subreddit)
+    if sort:
+        reports = reports.where(Report.sort == sort)
+    if since:
+        reports = reports.where(Report.timestamp >= since)
+    if until:
+        reports = reports.where(Report.timestamp < until)
+    report_ids = db.session.scalars(reports.order_by(Report.timestamp, Report.id)).all()
+
+    query = (select(Report.id, Report.subreddit, Report.sort, Report.timestamp, PostSnapshot.rank,
+                    Post.unique_id, Post.post_title, Post.post_author, Post.perma_link, Post.href_content,
+                    Post.media_content, PostSnapshot.post_score, PostSnapshot.comment_count, PostSnapshot.timestamp)
+             .select_from(PostSnapshot)
+             .join(Report, Report.id == PostSnapshot.report_id)
+             .join(Post, Post.id == PostSnapshot.post_id)
+             .order_by(PostSnapshot.id) # Snapshots are inserted in rank order
+             .execution_options(yield_per=EXPORT_BATCH_ROWS))
+    for export_report_id in report_ids:
+        result = db.session.execute(query.where(PostSnapshot.report_id == export_report_id))
+        try:
+            yield from result
+        finally:
+            result.close() # Also when a client disconnects part way through
+
+# Streams the posts of one report, or of every report matching the filters, as NDJSON, CSV or Parquet
+@app.route('/export')
+@app.route('/export/<int:report_id>')
+def export_posts(report_id=None):
+    export_format = request.args.get('format', 'ndjson')
+    error = check_format(export_format)
+    try:
+        filters = {
+            'report_id' : report_id,
+            'subreddit' : request.args.get('subreddit', '').strip() or None,
+            'sort' : request.args.get('sort') or None,
+            'since' : report_time(request.args.get('since')),
+            'until' : report_time(request.args.get('until'))
+        }
+    except ValueError:
+        error = error or "since and until must be ISO dates, e.g. 2024-05-01 or 2024-05-01T12:00:00"
+    if error:
+        return jsonify({'error': error}), 400
+    if report_id:
+        Report.query.get_or_404(report_id)
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    name = f"report_{report_id}" if report_id else f"posts_{filters['subreddit'] or 'all'}"
+    filename = f"{name}_{utc_now().strftime('%Y-%m-%d-%H%M%S')}.{extension}"
+    print(f"Exporting {name} as {export_format}")
+    return Response(stream_with_context(WRITERS[export_format](export_rows(**filters))), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+# ----------------------------------------------------------------------------------------- #
+
 # Fetches report using report id and downloads it
 @app.route('/download_report/<int:report_id>')
 async def download_report(report_id):
     try:
         get_report = Report.query.get_or_404(report_id)
         report_name = get_report.filename
-        if not os.path.isfile(report_name):
+        if not os.path.isfile(os.path.join(report_directory, report_name)):
             print(f"ERROR: Report File {report_name} does not exist")
             generate_html(report_id)
         return send_from_directory(report_directory, report_name, as_attachment=True)
@@ -334,51 +1596,38 @@ async def download_report(report_id):
 
 # ----------------------------------------------------------------------------------------- #
 
-# Fetches report and sends it via Telegram bot
+# Fetches report and queues it for Telegram, user_handle takes one or more comma separated handles
 @app.route('/send_report/<int:report_id>')
 async def send_report(report_id):
-    tele_handle = request.args.get('user_handle', '').strip()
+    tele_handles = [handle.strip().strip('@') for handle in request.args.get('user_handle', '').split(',')]
+    tele_handles = [handle for handle in tele_handles if handle] # Strips off the @
 
-    # Checks initialisation for telegram bot
-    if not telegram_bot:
+    # Checks initialisation for telegram bot, reports are sent by the bot process
+    if not token:
         print("ERROR: No Telegram Bot configured")
         return redirect(url_for('index'))
 
     # Checks if telegram handle has been inputted
-    if not tele_handle:
+    if not tele_handles:
         print("ERROR: No Telegram Handle")
         return redirect(url_for('index'))
 
-    tele_handle = tele_handle.strip('@') # Strips off the @
-    registered = TelegramUser.query.filter_by(handle=tele_handle).first()
-
-    # Checks if user is registered
-    if not registered:
-        print("ERROR: User not found")
-        return redirect(url_for('index'))
-
     try:
         report = Report.query.get_or_404(report_id)
-        report_path = os.path.join(report_directory, report.filename)
-
-        # Checks report generation and sends
-        if not os.path.exists(report_path):
-            generate_html(report_id)
+        queued = queue_report_delivery(
+            report,
+            tele_handles,
+            f"Here is the {report.post_count} post report for r/{report.subreddit}/{report.sort}"
+        )
 
-        with open(report_path, 'r', encoding='utf-8') as f:
-            await telegram_bot.send_document(
-                chat_id = registered.chat_id,
-                document = f,
-                filename = os.path.basename(report.filename),
-                caption = f"Here is the {report.post_count} post report for r/{report.subreddit}/{report.sort}"
-            )
-        print(f'Sent {report.filename} successfully to @{tele_handle}')
+        # Checks if user is registered
+        if not queued:
+            print("ERROR: User not found")
 
     # Error Handling
     except SQLAlchemyError as e:
+        db.session.rollback()
         print(f"ERROR: SQLite Database error: {e}")
-    except TelegramError as e:
-        print(f"ERROR: Telegram API Error: {e}")
     except Exception as e:
         print(f"ERROR: Unexpected error: {e}")
     return redirect(url_for('index'))
@@ -389,9 +1638,22 @@ async def send_report(report_id):
 @app.route('/delete_report/<int:report_id>')
 async def delete_report(report_id):
     report = Report.query.get_or_404(report_id)
+    report_cache.invalidate(report_id)
+    post_ids = [snapshot.post_id for snapshot in report.snapshots]
+    remove_report_rollup(report)
     db.session.delete(report)
+    db.session.flush()
+
+    # Canonical posts no other report has a snapshot of are removed with it
+    remove_orphaned_posts(post_ids)
     db.session.commit()
 
+    if report.snapshot_file:
+        try:
+            os.remove(os.path.join(archive_directory, report.snapshot_file))
+        except OSError as e:
+            print(f"WARNING: Unable to remove page archive {report.snapshot_file}: {e}")
+
     report_path = os.path.join(report_directory, report.filename)
     if os.path.exists(report_path):
         os.remove(report_path)
@@ -402,45 +1664,256 @@ async def delete_report(report_id):
     print(f"Report {report_id} successfully deleted")
     return redirect(url_for('index'))
 
+# Renders a report from the database and saves it to the reports directory, returns the HTML
 def generate_html(report_id):
     report = Report.query.get_or_404(report_id)
-    report_posts = Post.query.filter_by(report_id=report_id).all()
+    report_posts = load_report_posts(report)
     report_file = report.filename
     report_path = os.path.join(report_directory, report_file)
 
-    if report.sort == 'new':report_posts.sort(key=lambda p: p.crawled_at, reverse=True)
-    else: report_posts.sort(key=lambda p: p.post_score, reverse=True)
-
     # Generating and saving HTML Report
     print(f"Generating HTML Report for {report.subreddit}/{report.sort}, {report.post_count} posts")
-    html = render_template( # HTML that passes data into the template
-        'html_report.html',
-        posts = report_posts,
-        subreddit = report.subreddit,
-        sort = report.sort,
-        target_posts = report.post_count)
+    with metrics.stage_seconds.time(stage='render'):
+        html = render_template( # HTML that passes data into the template
+            'html_report.html',
+            posts = report_posts,
+            subreddit = report.subreddit,
+            sort = report.sort,
+            target_posts = report.post_count)
+
+        try:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                f.write(html)
+            print(f"DEBUG: Report successfully written to file: {report_path}")
+        except IOError as e:
+            metrics.errors.inc(stage='render', type=type(e).__name__)
+            print(f'ERROR: Failed to save {report_file}', 'error')
+        except Exception as e:
+            metrics.errors.inc(stage='render', type=type(e).__name__)
+            print(f'ERROR: Unexcepted error while saving', 'error')
+    report_cache.invalidate(report_id)
+    return html
 
+# ----------------------------------------------------------------------------------------- #
+
+"""
+    Commands, run with: flask --app crawl_application <command>
+"""
+@app.cli.command('reextract')
+@click.option('--report', 'report_ids', type=int, multiple=True, help='Report id to re-extract, every archived report by default')
+@click.option('--processes', type=int, default=None, help='Parser processes, the CPU count by default')
+@click.option('--dry-run', is_flag=True, help='Only print how many posts each report would get')
+def reextract_command(report_ids, processes, dry_run):
+    """
+        Re-runs post extraction over the archived pages of reports and replaces their posts
+    """
+    query = Report.query.with_entities(Report.id, Report.snapshot_file).filter(Report.snapshot_file.isnot(None))
+    if report_ids:
+        query = query.filter(Report.id.in_(report_ids))
+    archived = {os.path.join(archive_directory, snapshot_file): report_id
+                for report_id, snapshot_file in query.order_by(Report.id)}
+    print(f"Re-extracting {len(archived)} archived reports")
+
+    updated = failed = 0
+    for path, records, error in extract_snapshots(list(archived), processes):
+        report = db.session.get(Report, archived[path])
+        if error:
+            failed += 1
+            print(f"ERROR: Unable to re-extract report {report.id}: {error}")
+            continue
+
+        # Capped at the crawl's original target, posts keep the time of the original crawl
+        job = CrawlJob.query.filter_by(report_id=report.id).first()
+        target_posts = job.target_posts if job else report.post_count
+        stop_at = None
+        if job and job.schedule_id and job.sort == 'new' and (not job.schedule or job.schedule.incremental):
+            # Possibly incremental, the archived page also holds the older posts the crawl stopped at
+            stop_at = previous_crawl_ids(job.schedule_id, before_report=report.id)
+            target_posts = min(target_posts, report.post_count)
+        posts, _ = collect_posts(records, [], set(), stop_at)
+        posts = posts[:target_posts]
+        crawl_time = datetime.strptime(report.timestamp, '%Y-%m-%d-%H%M%S').strftime('%Y-%m-%dT%H:%M:%SZ')
+        for post in posts:
+            post.timestamp = crawl_time
+        print(f"Report {report.id}: {report.post_count} posts stored, {len(posts)} re-extracted")
+        if dry_run:
+            continue
+        if not posts:
+            failed += 1
+            print(f"WARNING: No posts found in the archive of report {report.id}, leaving it unchanged")
+            continue
+
+        old_post_ids = [post_id for (post_id,) in
+                        db.session.query(PostSnapshot.post_id).filter_by(report_id=report.id)]
+        PostSnapshot.query.filter_by(report_id=report.id).delete()
+        store_report_posts(report, posts, refresh=True)
+        remove_orphaned_posts(old_post_ids)
+        report.post_count = len(posts)
+        report.telegram_file_id = None # The stored upload is of the old report
+        db.session.commit()
+        if enrich_media:
+            enrich_report_media(report)
+        generate_html(report.id)
+        updated += 1
+
+    if updated:
+        rebuild_rollups() # New posts may now belong to other reports, so the rollups are recomputed
+    print(f"Re-extraction complete: {updated} reports updated, {failed} failed")
+
+@app.cli.command('export')
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson')
+@click.option('--report', 'report_id', type=int, default=None, help='Export the posts of one report')
+@click.option('--subreddit', default=None, help='Only reports of this subreddit')
+@click.option('--sort', default=None, help='Only reports with this sorting')
+@click.option('--since', default=None, help='Only reports crawled at or after this ISO date/datetime')
+@click.option('--until', default=None, help='Only reports crawled before this ISO date/datetime')
+@click.option('--output', type=click.File('wb'), default='-', help='File to write, stdout by default')
+def export_command(export_format, report_id, subreddit, sort, since, until, output):
+    """
+        Streams posts to a file in NDJSON, CSV or Parquet, the same export as /export
+    """
+    error = check_format(export_format)
+    if error:
+        raise click.UsageError(error)
     try:
-        with open(report_path, 'w', encoding='utf-8') as f:
-            f.write(html)
-        print(f"DEBUG: Report successfully written to file: {report_path}")
-    except IOError as e:
-        print(f'ERROR: Failed to save {report_file}', 'error')
-    except Exception as e:
-        print(f'ERROR: Unexcepted error while saving', 'error')
+        rows = export_rows(report_id, subreddit, sort, report_time(since), report_time(until))
+    except ValueError:
+        raise click.BadParameter("since and until must be ISO dates, e.g. 2024-05-01")
+    for chunk in WRITERS[export_format](rows):
+        output.write(chunk)
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """
+        Rebuilds the post search index from the post table
+    """
+    with db.engine.begin() as connection:
+        if not create_search_index(connection): # Built by now when the database was not migrated yet
+            rebuild_search_index(connection)
+    print(f"Search index rebuilt over {Post.query.count()} posts")
+
+@app.cli.command('rebuild-analytics')
+def rebuild_analytics_command():
+    """
+        Recomputes the analytics rollups from every stored report
+    """
+    print(f"Analytics rebuilt from {rebuild_rollups()} reports")
+
+"""
+    Process entry points - the web tier, crawl workers and the bot run as separate processes that
+    share only the database, see launcher.py. Run init-db once before starting them
+"""
+COMPONENTS = ('web', 'crawler', 'bot')
+
+def create_app(components = ('web',)):
+    """
+        App factory - returns the app with only the components a process runs loaded and warmed,
+        as a list or a comma separated string. Nothing is started, the entry points start workers
+        web - opens the database, compiles the templates and loads what async views run on, so
+              the first request of a new web worker does not pay for them
+        crawler - imports the crawl backend and starts the selenium backend's pooled browsers
+        bot - imports python-telegram-bot
+        Dependencies of the components left out are never imported. WSGI servers call it as
+        crawl_application:create_app() for the web tier
+    """
+    if isinstance(components, str):
+        components = [component.strip() for component in components.split(',') if component.strip()]
+    unknown = set(components) - set(COMPONENTS)
+    if unknown:
+        raise ValueError(f"Unknown components {', '.join(sorted(unknown))}, expected {', '.join(COMPONENTS)}")
+
+    if 'web' in components:
+        configure_mappers()
+        with app.app_context():
+            db.session.execute(select(1)) # First connection runs the pragmas
+            db.session.remove()
+        for template in app.jinja_env.list_templates():
+            app.jinja_env.get_template(template) # Compiled once, Jinja caches the result
+        import asgiref.sync # Flask runs the async views through it
+
+    if 'crawler' in components:
+        backend = os.getenv('CRAWL_BACKEND', 'selenium')
+        if backend == 'selenium': # Other backends start browsers only to fall back
+            get_driver_pool().warm()
+        else:
+            get_backend(backend)
+
+    if 'bot' in components:
+        import telegram.ext
+
+    return app
+
+@app.cli.command('init-db')
+def init_db_command():
+    """
+        Creates and migrates the database
+    """
+    db.create_all()
+    migrate_database()
+    print("Database initialized")
+
+# Blocks the main thread of a worker process until SIGTERM or Ctrl+C
+def wait_for_shutdown():
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    try:
+        while not stopping.wait(1): # Timed waits so Ctrl+C is delivered on Windows too
+            pass
+    except KeyboardInterrupt:
+        pass
+
+@app.cli.command('crawl-worker')
+@click.option('--workers', type=int, default=None, help='Crawl threads in this process, CRAWL_WORKERS by default')
+@click.option('--scheduler/--no-scheduler', default=True, help='Also queue due schedules, safe in every process')
+@click.option('--metrics-port', type=int, default=None, help="Serve this process's metrics on this port")
+def crawl_worker_command(workers, scheduler, metrics_port):
+    """
+        Runs queued crawl jobs until stopped, any number of these processes can run at once
+    """
+    if workers:
+        crawl_workers.workers = workers
+    if metrics_port:
+        metrics.serve_metrics(metrics_port)
+    create_app(['crawler'])
+    crawl_workers.start()
+    if scheduler:
+        crawl_scheduler.start()
+
+    wait_for_shutdown()
+    print("Crawl worker stopping, waiting for running crawls")
+    crawl_scheduler.shutdown()
+    crawl_workers.shutdown(timeout = float(os.getenv('CRAWL_SHUTDOWN_TIMEOUT', '30')))
+
+@app.cli.command('bot')
+@click.option('--metrics-port', type=int, default=None, help="Serve this process's metrics on this port")
+def bot_command(metrics_port):
+    """
+        Runs the Telegram bot and the report delivery sender, run exactly one of these processes
+    """
+    if metrics_port:
+        metrics.serve_metrics(metrics_port)
+    create_app(['bot'])
+    bot_polling()
 
 # ----------------------------------------------------------------------------------------- #
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        migrate_database()
         print("Database initialized")
 
     # To prevent opening multiple daemons on the same thread
     if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Loads every component, starting the pooled browsers once at start up
+        create_app(COMPONENTS)
+
         telegram_thread = threading.Thread(target=bot_polling)
         telegram_thread.daemon = True
         telegram_thread.start()
         print("Bot is initialized")
 
+        crawl_workers.start()
+        crawl_scheduler.start()
+
     app.run(debug=True)
@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+# ----------------------------------------------------------------------------------------- #
+# Cached crawl - the posts of one crawl and the target it was run with
+@dataclass
+class CachedCrawl:
+    posts: list
+    target_posts: int
+    crawled_at: str     # Report timestamp format, '%Y-%m-%d-%H%M%S'
+    created: float      # time.monotonic() when the crawl finished
+
+# ----------------------------------------------------------------------------------------- #
+# Crawl result cache - recent crawls by (subreddit, sort, target) with single flight coalescing
+class CrawlResultCache:
+    """
+        Keeps crawl results for ttl seconds. A cached or in-flight crawl of the same subreddit
+        and sort with at least the requested target satisfies the request, so identical requests
+        arriving together wait on one crawl instead of each starting their own. On a miss the
+        optional shared_lookup(subreddit, sort, target_posts) can return a CachedCrawl made by
+        another process before crawl() is called
+    """
+    def __init__(self, ttl: float = 300.0, shared_lookup=None):
+        self.ttl = ttl
+        self.shared_lookup = shared_lookup
+        self._entries = {}   # (subreddit, sort) -> {target_posts: CachedCrawl}
+        self._in_flight = {} # (subreddit, sort, target_posts) -> Future of the CachedCrawl
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(subreddit: str, sort: str) -> tuple[str, str]:
+        return subreddit.lower(), sort
+
+    def _lookup(self, key: tuple[str, str], target_posts: int) -> CachedCrawl | None:
+        now = time.monotonic()
+        entries = self._entries.get(key, {})
+        for target in [target for target, entry in entries.items() if now - entry.created > self.ttl]:
+            del entries[target]
+        fresh = [entry for target, entry in entries.items() if target >= target_posts]
+        return max(fresh, key=lambda entry: entry.created) if fresh else None
+
+    def get_or_crawl(self, subreddit: str, sort: str, target_posts: int, crawl) -> tuple[list, CachedCrawl | None]:
+        """
+            Returns (posts, cached crawl) - the cached crawl is None when crawl() was called
+            for this request, crawl() returns the posts for the full target
+        """
+        key = self._key(subreddit, sort)
+        with self._lock:
+            cached = self._lookup(key, target_posts)
+            if cached:
+                return cached.posts[:target_posts], cached
+            flight = next((future for (flight_key, flight_target), future in self._in_flight.items()
+                           if flight_key == key and flight_target >= target_posts), None)
+            owner = flight is None
+            if owner:
+                flight = Future()
+                self._in_flight[(key, target_posts)] = flight
+
+        if not owner:
+            print(f"Waiting on the in-flight crawl of r/{subreddit}/{sort}")
+            shared = flight.result() # Raises if the shared crawl raised
+            if shared and shared.posts:
+                return shared.posts[:target_posts], shared
+            return [], None # The shared crawl found nothing, the caller fails or retries as usual
+
+        try:
+            shared = self.shared_lookup(subreddit, sort, target_posts) if self.shared_lookup and self.ttl > 0 else None
+            if shared:
+                with self._lock:
+                    self._entries.setdefault(key, {})[shared.target_posts] = shared
+                flight.set_result(shared)
+                return shared.posts[:target_posts], shared
+
+            posts = crawl()
+            result = CachedCrawl(
+                posts=posts,
+                target_posts=target_posts,
+                crawled_at=datetime.now(timezone.utc).strftime('%Y-%m-%d-%H%M%S'),
+                created=time.monotonic()
+            )
+            if posts and self.ttl > 0:
+                with self._lock:
+                    self._entries.setdefault(key, {})[target_posts] = result
+            flight.set_result(result)
+            return posts, None
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop((key, target_posts), None)
@@ -0,0 +1,197 @@
+import os
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import false, or_
+
+import metrics
+
+# ----------------------------------------------------------------------------------------- #
+# Job states - a job moves queued -> running -> succeeded/failed/cancelled, failed attempts
+# with retries left go back to queued with a backoff delay
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+class JobCancelled(Exception):
+    """
+        Raised inside a job handler once cancellation has been requested
+    """
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# ----------------------------------------------------------------------------------------- #
+# Worker pool - a fixed number of threads that claim queued jobs from the database
+class JobWorkerPool:
+    """
+        Runs persisted jobs on a bounded set of worker threads. Jobs are claimed with a
+        conditional UPDATE so a job only ever runs on one worker, failed jobs are retried
+        with exponential backoff until max_attempts, and handlers are called as
+        handler(job, check_cancelled) inside an application context. An optional
+        can_run(job) hook lets queued jobs wait, e.g. for a per batch concurrency limit.
+
+        Several pools may run in separate processes on one database. Each claimed job records
+        the pool's worker_id and a heartbeat the pool refreshes while it runs, jobs whose
+        heartbeat is older than stale_after belong to a stopped process and are re-queued
+    """
+    def __init__(self, app, db, job_model, handler, workers: int = 2,
+                 poll_interval: float = 5.0, retry_backoff: float = 30.0, can_run=None,
+                 heartbeat_interval: float = 15.0, stale_after: float = 90.0):
+        self.app = app
+        self.db = db
+        self.job_model = job_model
+        self.handler = handler
+        self.can_run = can_run
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retry_backoff = retry_backoff
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._claim_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self) -> None:
+        with self.app.app_context():
+            self.recover()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"crawl-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, name="crawl-heartbeat", daemon=True)
+        heartbeat.start()
+        print(f"Started {self.workers} crawl workers as {self.worker_id}")
+
+    def notify(self) -> None:
+        """
+            Wakes idle workers straight away instead of waiting for the next poll
+        """
+        self._wake.set()
+
+    def shutdown(self, timeout: float = None) -> None:
+        """
+            Stops claiming jobs and waits up to timeout seconds for running ones, jobs still
+            running after that are re-queued for another process
+        """
+        self._stop.set()
+        self._wake.set()
+        if timeout is None:
+            return
+        for thread in self._threads:
+            thread.join(timeout)
+        with self.app.app_context():
+            Job = self.job_model
+            count = (Job.query.filter_by(status=RUNNING, worker_id=self.worker_id)
+                     .update({'status': QUEUED, 'updated_at': utc_now()}))
+            self.db.session.commit()
+        if count:
+            print(f"WARNING: Re-queued {count} crawl jobs interrupted by shutdown")
+
+    def recover(self) -> None:
+        """
+            Re-queues jobs whose process stopped mid crawl, found by their missing heartbeat
+        """
+        Job = self.job_model
+        stale = utc_now() - timedelta(seconds=self.stale_after)
+        count = (Job.query.filter(Job.status == RUNNING, or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < stale))
+                 .update({'status': QUEUED, 'updated_at': utc_now()}, synchronize_session=False))
+        self.db.session.commit()
+        if count:
+            print(f"WARNING: Re-queued {count} interrupted crawl jobs")
+
+    def claim(self):
+        """
+            Claims the oldest runnable queued job, None if there is nothing to do
+        """
+        Job = self.job_model
+        with self._claim_lock:
+            # Takes the database write lock before reading, so pools in other processes claim
+            # one at a time and can_run sees the jobs they have claimed
+            Job.query.filter(false()).update({'status': Job.status}, synchronize_session=False)
+            candidates = (Job.query
+                          .filter(Job.status == QUEUED, Job.run_after <= utc_now())
+                          .order_by(Job.id).limit(self.workers * 5).all())
+            for job in candidates:
+                if self.can_run and not self.can_run(job):
+                    continue
+                claimed = (Job.query.filter_by(id=job.id, status=QUEUED)
+                           .update({'status': RUNNING, 'attempts': Job.attempts + 1, 'worker_id': self.worker_id,
+                                    'heartbeat_at': utc_now(), 'updated_at': utc_now()}))
+                self.db.session.commit()
+                if claimed:
+                    return self.db.session.get(Job, job.id)
+            self.db.session.commit()
+        return None
+
+    def _check_cancelled(self, job_id: int):
+        def check_cancelled() -> None:
+            Job = self.job_model
+            cancelled = Job.query.with_entities(Job.cancel_requested).filter_by(id=job_id).scalar()
+            if cancelled:
+                raise JobCancelled(f"Job {job_id} was cancelled")
+        return check_cancelled
+
+    def _finish(self, job_id: int, **values) -> None:
+        self.db.session.rollback()
+        job = self.db.session.get(self.job_model, job_id)
+        if job.status != RUNNING or job.worker_id != self.worker_id:
+            print(f"WARNING: Crawl job {job_id} was re-queued while it ran here, keeping its current state")
+            return
+        for key, value in values.items():
+            setattr(job, key, value)
+        job.updated_at = utc_now()
+        self.db.session.commit()
+
+    def run(self, job) -> None:
+        job_id, attempts, max_attempts = job.id, job.attempts, job.max_attempts
+        print(f"Running crawl job {job_id} (attempt {attempts}/{max_attempts})")
+        try:
+            result = self.handler(job, self._check_cancelled(job_id))
+            self._finish(job_id, status=SUCCEEDED, report_id=result, error=None)
+            print(f"Crawl job {job_id} succeeded")
+        except JobCancelled:
+            self._finish(job_id, status=CANCELLED)
+            print(f"Crawl job {job_id} cancelled")
+        except Exception as e:
+            metrics.errors.inc(stage='job', type=type(e).__name__)
+            if attempts < max_attempts:
+                delay = self.retry_backoff * 2 ** (attempts - 1)
+                self._finish(job_id, status=QUEUED, error=str(e)[:500], run_after=utc_now() + timedelta(seconds=delay))
+                print(f"ERROR: Crawl job {job_id} failed, retrying in {delay:.0f}s: {e}")
+            else:
+                self._finish(job_id, status=FAILED, error=str(e)[:500])
+                print(f"ERROR: Crawl job {job_id} failed: {e}")
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    job = self.claim()
+                    if job:
+                        self.run(job)
+                        continue
+            except Exception as e:
+                print(f"ERROR: Crawl worker error: {e}")
+
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _heartbeat(self) -> None:
+        """
+            Marks this pool's running jobs as alive and re-queues the stale jobs of other processes
+        """
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                with self.app.app_context():
+                    Job = self.job_model
+                    Job.query.filter_by(status=RUNNING, worker_id=self.worker_id).update({'heartbeat_at': utc_now()})
+                    self.db.session.commit()
+                    self.recover()
+            except Exception as e:
+                print(f"ERROR: Crawl heartbeat error: {e}")
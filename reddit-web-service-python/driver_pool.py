@@ -0,0 +1,264 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from selenium.common.exceptions import WebDriverException
+
+import metrics
+
+# Selenium's webdriver and webdriver_manager are imported when the first driver is built, so the
+# processes that never crawl (web tier, bot) do not pay for them at start up
+if TYPE_CHECKING:
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+# ----------------------------------------------------------------------------------------- #
+# Settings for Chrome web engine
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36"
+
+# Browser modes - 'full' loads the page as a user would, 'lean' only loads what the
+# shreddit-post elements need: no images, media, fonts, ads or tracking, and eager page loads
+BROWSER_MODES = ('full', 'lean')
+
+# Network.setBlockedURLs patterns for lean drivers, LEAN_BLOCKED_URLS adds comma separated patterns
+LEAN_BLOCKED_URLS = (
+    '*.jpg*', '*.jpeg*', '*.png*', '*.gif*', '*.webp*', '*.avif*', '*.svg*', '*.ico*',
+    '*.mp4*', '*.webm*', '*.m3u8*', '*.mpd*', '*.woff*', '*.woff2*', '*.ttf*', '*.otf*',
+    '*://i.redd.it/*', '*://v.redd.it/*', '*://preview.redd.it/*', '*://external-preview.redd.it/*',
+    '*://styles.redditmedia.com/*', '*://emoji.redditmedia.com/*', '*://www.redditstatic.com/avatars/*',
+    '*://alb.reddit.com/*', '*://w3-reporting.reddit.com/*', '*://error-tracking.reddit.com/*',
+    '*doubleclick.net*', '*googlesyndication.com*', '*googletagmanager.com*', '*google-analytics.com*',
+    '*googleadservices.com*', '*facebook.net*', '*adsafeprotected.com*', '*amazon-adsystem.com*',
+    '*scorecardresearch.com*', '*moatads.com*'
+)
+
+def build_chrome_options(mode: str = 'full') -> "Options":
+    """
+        Headless Chrome options shared by every pooled driver of a mode
+    """
+    from selenium.webdriver.chrome.options import Options
+
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--window-size=1920x1080")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument(f"user-agent={USER_AGENT}")
+    if mode == 'lean':
+        chrome_options.page_load_strategy = 'eager' # Returns at DOMContentLoaded, posts are awaited anyway
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_argument("--mute-audio")
+        chrome_options.add_argument("--autoplay-policy=user-gesture-required")
+        chrome_options.add_argument("--disable-extensions")
+        chrome_options.add_argument("--disable-background-networking")
+        chrome_options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.default_content_setting_values.notifications": 2
+        })
+    return chrome_options
+
+def lean_blocked_urls() -> list[str]:
+    extra = [pattern.strip() for pattern in os.getenv('LEAN_BLOCKED_URLS', '').split(',') if pattern.strip()]
+    return list(LEAN_BLOCKED_URLS) + extra
+
+# ----------------------------------------------------------------------------------------- #
+# Pool entry - keeps track of how many crawls a browser has served
+@dataclass
+class PooledDriver:
+    driver: "webdriver.Chrome"
+    crawls: int = 0
+    created: float = field(default_factory=time.monotonic)
+
+# ----------------------------------------------------------------------------------------- #
+# Driver pool - keeps warm headless browsers around so crawls skip the Chrome cold start
+class DriverPool:
+    """
+        Leases warm Chrome drivers to crawls. Drivers are health checked before every lease,
+        have their cookies and storage reset when returned, and are recycled after max_crawls.
+        Every driver of a pool runs in the pool's browser mode
+    """
+    def __init__(self, size: int = 2, max_crawls: int = 20, lease_timeout: float = 300, driver_path: str = None,
+                 mode: str = 'full'):
+        if mode not in BROWSER_MODES:
+            raise ValueError(f"Unknown browser mode {mode}")
+        self.mode = mode
+        self.size = size
+        self.max_crawls = max_crawls
+        self.lease_timeout = lease_timeout
+        if not driver_path:
+            from webdriver_manager.chrome import ChromeDriverManager
+            driver_path = ChromeDriverManager().install() # Resolved once per pool
+        self.driver_path = driver_path
+        self._idle = []
+        self._total = 0
+        self._closed = False
+        self._lock = threading.Condition()
+
+    def _create(self) -> PooledDriver:
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+
+        service = Service(self.driver_path)
+        with metrics.stage_seconds.time(stage='driver_startup'):
+            driver = webdriver.Chrome(service=service, options=build_chrome_options(self.mode))
+        driver.set_page_load_timeout(90)
+        if self.mode == 'lean': # Blocking lasts for the driver's lifetime, about:blank resets keep it
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": lean_blocked_urls()})
+        print(f"DEBUG: Started pooled {self.mode} Chrome driver ({self._total}/{self.size})")
+        return PooledDriver(driver=driver)
+
+    @staticmethod
+    def _quit(entry: PooledDriver) -> None:
+        try:
+            entry.driver.quit()
+        except Exception as e:
+            print(f"WARNING: Failed to quit pooled driver: {e}")
+
+    @staticmethod
+    def _healthy(entry: PooledDriver) -> bool:
+        try:
+            return entry.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(entry: PooledDriver) -> None:
+        """
+            Clears session state so the next lease starts logged out with no cookies
+        """
+        driver = entry.driver
+        driver.get("about:blank")
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Storage.clearDataForOrigin", {
+            "origin": "https://www.reddit.com",
+            "storageTypes": "cookies,local_storage,session_storage,indexeddb,service_workers"
+        })
+
+    def _acquire(self) -> PooledDriver:
+        deadline = time.monotonic() + self.lease_timeout
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Driver pool is shut down")
+                if self._idle:
+                    entry = self._idle.pop() # Most recently used browser is the warmest
+                    break
+                if self._total < self.size:
+                    self._total += 1
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No Chrome driver free after {self.lease_timeout}s")
+                self._lock.wait(remaining)
+
+        # Browser start up and health checks happen outside the lock
+        try:
+            if entry is not None and not self._healthy(entry):
+                print("WARNING: Pooled driver failed health check, replacing it")
+                self._quit(entry)
+                entry = None
+            if entry is None:
+                entry = self._create()
+        except Exception:
+            with self._lock:
+                self._total -= 1
+                self._lock.notify()
+            raise
+        return entry
+
+    def _release(self, entry: PooledDriver, healthy: bool) -> None:
+        entry.crawls += 1
+        keep = healthy and not self._closed and entry.crawls < self.max_crawls
+        if keep:
+            try:
+                self._reset(entry)
+            except Exception as e:
+                print(f"WARNING: Failed to reset pooled driver: {e}")
+                keep = False
+
+        if not keep:
+            print(f"DEBUG: Recycling pooled driver after {entry.crawls} crawls")
+            self._quit(entry)
+
+        with self._lock:
+            if keep:
+                self._idle.append(entry)
+            else:
+                self._total -= 1
+            self._lock.notify()
+
+    @contextmanager
+    def lease(self):
+        """
+            Context manager that hands out a driver and returns it to the pool afterwards,
+            a driver that raised a WebDriverException is discarded instead of reused
+        """
+        entry = self._acquire()
+        healthy = True
+        try:
+            yield entry.driver
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            self._release(entry, healthy)
+
+    def warm(self) -> None:
+        """
+            Starts browsers up front so the first crawls do not pay the cold start
+        """
+        entries = []
+        try:
+            for _ in range(self.size):
+                entries.append(self._acquire())
+        except Exception as e:
+            print(f"WARNING: Unable to warm driver pool: {e}")
+        for entry in entries:
+            with self._lock:
+                self._idle.append(entry)
+                self._lock.notify()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+            self._lock.notify_all()
+        for entry in idle:
+            self._quit(entry)
+
+# ----------------------------------------------------------------------------------------- #
+# Shared pools, one per browser mode, configured through environment variables
+_pools = {}
+_pool_lock = threading.Lock()
+
+def pool_size(mode: str = None) -> int:
+    """
+        Browsers in the pool of a browser mode, CRAWL_BROWSER_MODE when no mode is given
+    """
+    mode = mode or os.getenv('CRAWL_BROWSER_MODE', 'full')
+    return int(os.getenv(f'DRIVER_POOL_SIZE_{mode.upper()}', os.getenv('DRIVER_POOL_SIZE', '2')))
+
+def get_driver_pool(mode: str = None) -> DriverPool:
+    """
+        The shared pool of a browser mode, CRAWL_BROWSER_MODE when no mode is given
+    """
+    mode = mode or os.getenv('CRAWL_BROWSER_MODE', 'full')
+    with _pool_lock:
+        if mode not in _pools:
+            pool = DriverPool(
+                size=pool_size(mode),
+                max_crawls=int(os.getenv('DRIVER_POOL_MAX_CRAWLS', '20')),
+                lease_timeout=float(os.getenv('DRIVER_POOL_LEASE_TIMEOUT', '300')),
+                driver_path=next(iter(_pools.values())).driver_path if _pools else None,
+                mode=mode
+            )
+            atexit.register(pool.shutdown)
+            _pools[mode] = pool
+        return _pools[mode]
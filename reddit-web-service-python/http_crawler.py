@@ -0,0 +1,110 @@
+import os
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+from driver_pool import USER_AGENT
+from reddit_crawler import CrawlBackend, Post, collect_posts, rate_limiter
+
+# ----------------------------------------------------------------------------------------- #
+# Browserless crawl backend - reads the subreddit listing JSON and follows the 'after' cursor
+class HttpBackend(CrawlBackend):
+    """
+        Fetches listing pages over a pooled keep-alive requests.Session with retries and
+        backoff, sleeping whenever Reddit's rate limit headers say the quota is spent
+    """
+    name = 'http'
+    page_limit = 100 # Largest page the listing endpoint serves
+
+    def __init__(self, base_url: str = None, timeout: float = 30, retries: int = 3,
+                 backoff_factor: float = 1.0, pool_size: int = 10):
+        self.base_url = (base_url or os.getenv('REDDIT_BASE_URL', 'https://www.reddit.com')).rstrip('/')
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=('GET',),
+            respect_retry_after_header=True
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'User-Agent': USER_AGENT,
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate'
+        })
+
+    def _respect_rate_limit(self, response: requests.Response) -> None:
+        """
+            Waits out the window when x-ratelimit-remaining reaches zero
+        """
+        remaining = response.headers.get('x-ratelimit-remaining')
+        reset = response.headers.get('x-ratelimit-reset')
+        try:
+            if remaining is not None and reset is not None and float(remaining) < 1:
+                print(f"DEBUG: Rate limit reached, sleeping {reset}s")
+                time.sleep(float(reset))
+        except ValueError:
+            pass
+
+    def fetch_page(self, subreddit: str, sort: str, limit: int, after: str = None) -> dict:
+        params = {'limit': limit, 'raw_json': 1}
+        if after:
+            params['after'] = after
+        rate_limiter.wait(urllib.parse.urlparse(self.base_url).netloc)
+        response = self.session.get(f"{self.base_url}/r/{subreddit}/{sort}.json", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        self._respect_rate_limit(response)
+        return response.json()['data']
+
+    @staticmethod
+    def listing_attributes(child: dict) -> dict:
+        """
+            Maps a listing child onto the shreddit-post attribute names used by build_post
+        """
+        data = child.get('data', {})
+        return {
+            'id': data.get('name'),
+            'permalink': data.get('permalink'),
+            'content-href': data.get('url'),
+            'comment-count': data.get('num_comments'),
+            'post-title': data.get('title'),
+            'author': data.get('author'),
+            'score': data.get('score')
+        }
+
+    def crawl(self, subreddit: str, sort: str, target_posts: int, stop_at: set[str] = None,
+              snapshots: list = None) -> list[Post]:
+        print(f"Beginning HTTP crawl for {self.base_url}/r/{subreddit}/{sort}")
+        crawled_posts = []
+        unique_ids = set()
+        after = None
+
+        while len(crawled_posts) < target_posts:
+            with metrics.stage_seconds.time(stage='page_load'):
+                page = self.fetch_page(subreddit, sort, min(self.page_limit, target_posts - len(crawled_posts)), after)
+            if snapshots is not None:
+                snapshots.append(page)
+            with metrics.stage_seconds.time(stage='extract'):
+                records = [self.listing_attributes(child) for child in page.get('children', [])]
+                crawled_posts, reached_known = collect_posts(records, crawled_posts, unique_ids, stop_at)
+            if reached_known:
+                print(f"Reached posts from the previous crawl, stopping with {len(crawled_posts)} new posts")
+                break
+
+            print(f"Crawling {len(crawled_posts)}/{target_posts}")
+            if not page.get('after') or page.get('after') == after: # End of the listing
+                break
+            after = page.get('after')
+
+        print(f"HTTP crawling complete. Total posts: {len(crawled_posts)}")
+        return crawled_posts[:target_posts]
@@ -0,0 +1,125 @@
+"""
+    Starts the service on one machine as separate processes that share the SQLite database -
+    the web tier, crawl worker processes and the Telegram bot - and stops them together.
+
+    python launcher.py                                          # Web tier, 2 crawl processes and the bot
+    python launcher.py --web-workers 8 --crawl-processes 4      # More of each
+    python launcher.py --no-bot --metrics-port 0                # No bot, no metrics ports
+
+    The web tier runs on gunicorn when it is installed (not on Windows), on waitress otherwise.
+    Each process can also be started on its own:
+    gunicorn --workers 4 "crawl_application:create_app()"
+    flask --app crawl_application crawl-worker [--workers N] [--metrics-port PORT]
+    flask --app crawl_application bot [--metrics-port PORT]
+"""
+import argparse
+import importlib.util
+import os
+import platform
+import signal
+import subprocess
+import sys
+import time
+
+APPLICATION = 'crawl_application'
+WEB_APPLICATION = f'{APPLICATION}:create_app()' # Builds the web tier only, see create_app
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+def flask_command(*args, application: str = APPLICATION) -> list[str]:
+    return [sys.executable, '-m', 'flask', '--app', application, *args]
+
+def web_command(host: str, port: int, workers: int, threads: int) -> list[str]:
+    """
+        gunicorn worker processes where gunicorn runs, waitress threads otherwise, and Flask's
+        development server when neither is installed
+    """
+    if platform.system() != 'Windows' and importlib.util.find_spec('gunicorn'):
+        return [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+                '--bind', f'{host}:{port}', WEB_APPLICATION]
+    if importlib.util.find_spec('waitress'):
+        return [sys.executable, '-m', 'waitress', '--threads', str(workers * threads),
+                '--listen', f'{host}:{port}', '--call', f'{APPLICATION}:create_app']
+    print("WARNING: Neither gunicorn nor waitress is installed, serving with the Flask development server")
+    return flask_command('run', '--host', host, '--port', str(port), '--no-reload', '--with-threads',
+                         application=WEB_APPLICATION)
+
+def stop(processes: dict, timeout: float) -> None:
+    """
+        Asks every process to stop, crawl workers finish or re-queue their crawls, then kills
+        whatever is still running after timeout seconds
+    """
+    for process in processes.values():
+        if process.poll() is None:
+            process.terminate()
+    deadline = time.monotonic() + timeout
+    for name, process in processes.items():
+        try:
+            process.wait(max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            print(f"WARNING: {name} did not stop in {timeout:.0f}s, killing it")
+            process.kill()
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Runs the web tier, crawl workers and bot as separate processes')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--web-workers', type=int, default=4, help='Web worker processes (gunicorn)')
+    parser.add_argument('--web-threads', type=int, default=4, help='Threads per web worker')
+    parser.add_argument('--crawl-processes', type=int, default=2, help='Crawl worker processes')
+    parser.add_argument('--crawl-workers', type=int, default=None, help='Crawl threads per process, CRAWL_WORKERS by default')
+    parser.add_argument('--no-bot', action='store_true', help='Do not start the Telegram bot process')
+    parser.add_argument('--metrics-port', type=int, default=9100,
+                        help='First metrics port, one per crawl and bot process, 0 turns them off')
+    args = parser.parse_args()
+
+    # Created and migrated once, before several processes could race to do it
+    subprocess.run(flask_command('init-db'), cwd=DIRECTORY, check=True)
+
+    commands = {'web': web_command(args.host, args.port, args.web_workers, args.web_threads)}
+    for number in range(args.crawl_processes):
+        command = flask_command('crawl-worker')
+        if args.crawl_workers:
+            command += ['--workers', str(args.crawl_workers)]
+        if number: # Schedules run from the first crawl process only
+            command.append('--no-scheduler')
+        commands[f'crawl-{number}'] = command
+    if not args.no_bot:
+        commands['bot'] = flask_command('bot')
+    if args.metrics_port:
+        for offset, name in enumerate(name for name in commands if name != 'web'):
+            commands[name] += ['--metrics-port', str(args.metrics_port + offset)]
+
+    # The web tier caps batch concurrency to the crawls these processes can run at once
+    environment = {**os.environ, 'CRAWL_PROCESSES': str(args.crawl_processes)}
+    if args.crawl_workers:
+        environment['CRAWL_WORKERS'] = str(args.crawl_workers)
+
+    processes = {}
+    for name, command in commands.items():
+        processes[name] = subprocess.Popen(command, cwd=DIRECTORY, env=environment)
+        print(f"Started {name} (pid {processes[name].pid})")
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    exit_code = 0
+    try:
+        while not stopping:
+            bot = processes.get('bot')
+            if bot and bot.poll() is not None: # Reports are still crawled and served without it
+                print(f"WARNING: bot exited with status {bot.returncode}, Telegram delivery is stopped")
+                del processes['bot']
+            exited = [(name, process.returncode) for name, process in processes.items() if process.poll() is not None]
+            if exited:
+                name, exit_code = exited[0]
+                print(f"ERROR: {name} exited with status {exit_code}, stopping the other processes")
+                break
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+    print("Stopping all processes")
+    stop(processes, timeout = float(os.getenv('CRAWL_SHUTDOWN_TIMEOUT', '30')) + 10)
+    return exit_code or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
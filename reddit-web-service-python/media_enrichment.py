@@ -0,0 +1,212 @@
+import hashlib
+import importlib.util
+import io
+import ipaddress
+import mimetypes
+import os
+import socket
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from analytics import media_kind
+from driver_pool import USER_AGENT
+
+# Optional, thumbnails are skipped when it is not installed. Only looked up here, Pillow is
+# imported by the first thumbnail so the web tier does not load it
+THUMBNAILS_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+if TYPE_CHECKING:
+    import requests # Imported with the first fetch, processes that never crawl do not load it
+
+# Media urls come from posts, so they are only fetched over http(s) from public addresses and
+# redirects are followed one hop at a time, each hop checked again
+MEDIA_SCHEMES = ('http', 'https')
+MAX_REDIRECTS = 5
+
+# ----------------------------------------------------------------------------------------- #
+# Media metadata - what enrichment learnt about one media url
+@dataclass
+class MediaInfo:
+    url: str
+    content_type: str | None = None
+    size: int | None = None
+    digest: str | None = None       # sha256 of the media content
+    filename: str | None = None     # Local copy of the media in the media store
+    thumbnail: str | None = None    # Downscaled JPEG in the media store
+    error: str | None = None
+
+# ----------------------------------------------------------------------------------------- #
+# Media store - content addressed files, '<first 2 hex>/<sha256><ext>', shared by every report
+class MediaStore:
+    """
+        Files are named by the hash of the media content, so the same image crawled by many
+        reports (or under different urls) is stored and thumbnailed once
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def filename(digest: str, suffix: str) -> str:
+        return f"{digest[:2]}/{digest}{suffix}"
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def has(self, filename: str) -> bool:
+        return os.path.exists(self.path(filename))
+
+    def write(self, filename: str, data: bytes) -> None:
+        path = self.path(filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp" # Two crawls may store the same file
+        with open(temporary, 'wb') as f: # Renamed into place so a half written file is never served
+            f.write(data)
+        os.replace(temporary, path)
+
+# ----------------------------------------------------------------------------------------- #
+# Media enrichment - fetches media metadata and thumbnails over a pooled session
+class MediaEnricher:
+    """
+        Fetches the media of crawled posts on a fixed pool of threads shared by every crawl, so
+        concurrent crawls never have more than workers downloads open. Images are downloaded,
+        stored and thumbnailed, videos only get a HEAD request for their type and size.
+        allow_private lets it fetch from loopback and private addresses, for local test servers only
+    """
+    def __init__(self, store: MediaStore, workers: int = 8, timeout: float = 15,
+                 max_bytes: int = 20 * 1024 * 1024, thumbnail_size: int = 320, allow_private: bool = False):
+        self.store = store
+        self.allow_private = allow_private
+        self.workers = workers
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="media-fetch")
+
+    @property
+    def session(self) -> "requests.Session":
+        """
+            Pooled session with retries, built on first use
+        """
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                              allowed_methods=('GET', 'HEAD'), respect_retry_after_header=True)
+                adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers, max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({'User-Agent': USER_AGENT})
+                self._session = session
+            return self._session
+
+    def _check_url(self, url: str) -> None:
+        """
+            Raises ValueError for urls that are not http(s) or whose host resolves to a loopback,
+            private, link local or otherwise non public address
+        """
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme not in MEDIA_SCHEMES or not parsed.hostname:
+            raise ValueError(f"Refusing to fetch media from {url[:200]}: not an http(s) url")
+        if self.allow_private:
+            return
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        try:
+            addresses = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+        except socket.gaierror as e:
+            raise ValueError(f"Unable to resolve {parsed.hostname}: {e}")
+        for *_, address in addresses:
+            if not ipaddress.ip_address(address[0].split('%')[0]).is_global:
+                raise ValueError(f"Refusing to fetch media from {parsed.hostname}: not a public address")
+
+    def _request(self, method: str, url: str, **kwargs) -> "requests.Response":
+        for _ in range(MAX_REDIRECTS + 1):
+            self._check_url(url)
+            response = self.session.request(method, url, timeout=self.timeout, allow_redirects=False, **kwargs)
+            if not response.is_redirect:
+                return response
+            response.close()
+            url = urllib.parse.urljoin(url, response.headers['Location'])
+        raise ValueError(f"More than {MAX_REDIRECTS} redirects fetching media")
+
+    @staticmethod
+    def _content_type(response: "requests.Response") -> str | None:
+        content_type = response.headers.get('Content-Type')
+        return content_type.split(';')[0].strip().lower() if content_type else None
+
+    def _thumbnail(self, data: bytes) -> bytes:
+        from PIL import Image
+
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft('RGB', (self.thumbnail_size, self.thumbnail_size)) # Lets JPEGs decode at a lower scale
+            image.thumbnail((self.thumbnail_size, self.thumbnail_size))
+            buffer = io.BytesIO()
+            image.convert('RGB').save(buffer, 'JPEG', quality=80, optimize=True)
+            return buffer.getvalue()
+
+    def fetch(self, url: str) -> MediaInfo:
+        info = MediaInfo(url=url)
+        if media_kind(url) == 'video':
+            response = self._request('HEAD', url)
+            response.raise_for_status()
+            info.content_type = self._content_type(response)
+            info.size = int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None
+            return info
+
+        with self._request('GET', url, stream=True) as response:
+            response.raise_for_status()
+            info.content_type = self._content_type(response)
+            declared_size = response.headers.get('Content-Length')
+            info.size = int(declared_size) if declared_size else None
+            if not (info.content_type or '').startswith('image/') or (info.size or 0) > self.max_bytes:
+                return info # Pages and oversized files only get their metadata
+
+            data = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > self.max_bytes:
+                    return info
+        data = bytes(data)
+        info.size = len(data)
+
+        info.digest = hashlib.sha256(data).hexdigest()
+        extension = (mimetypes.guess_extension(info.content_type)
+                     or os.path.splitext(urllib.parse.urlparse(url).path)[1].lower() or '.bin')
+        info.filename = self.store.filename(info.digest, extension)
+        if not self.store.has(info.filename):
+            self.store.write(info.filename, data)
+
+        if THUMBNAILS_AVAILABLE:
+            from PIL import Image
+
+            thumbnail = self.store.filename(info.digest, '.thumb.jpg')
+            try:
+                if not self.store.has(thumbnail):
+                    self.store.write(thumbnail, self._thumbnail(data))
+                info.thumbnail = thumbnail
+            except (OSError, ValueError, Image.DecompressionBombError) as e: # Unreadable or hostile images
+                info.error = f"Thumbnail failed: {e}"[:500]
+        return info
+
+    def _fetch_safely(self, url: str) -> MediaInfo:
+        import requests
+
+        try:
+            return self.fetch(url)
+        except (requests.RequestException, OSError, ValueError) as e:
+            return MediaInfo(url=url, error=str(e)[:500])
+
+    def enrich(self, urls: list[str]) -> list[MediaInfo]:
+        """
+            Fetches every url on the shared pool, results are in the order of urls
+        """
+        return list(self._executor.map(self._fetch_safely, urls))
@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ----------------------------------------------------------------------------------------- #
+# Minimal Prometheus style metrics - counters and histograms with labels, rendered in the
+# text exposition format by /metrics. Set METRICS_LOG=1 to also print every observation as
+# a JSON log line
+LOG_METRICS = os.getenv('METRICS_LOG', '0') == '1'
+
+def _label_text(label_names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _log(name: str, labels: dict, value: float) -> None:
+    if LOG_METRICS:
+        print(json.dumps({'metric': name, **labels, 'value': round(value, 6), 'time': time.time()}))
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {} if label_names else {(): 0} # Unlabelled counters are exported from zero
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not amount:
+            return
+        key = tuple(str(labels.get(name, '')) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _log(self.name, labels, amount)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_label_text(self.label_names, key)} {value}')
+        return lines
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._values = {} # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, '')) for name in self.label_names)
+        with self._lock:
+            series = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+        _log(self.name, labels, value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    bucket_labels = _label_text(self.label_names, key, f'le="{bound}"')
+                    lines.append(f'{self.name}_bucket{bucket_labels} {bucket_count}')
+                bucket_labels = _label_text(self.label_names, key, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+                lines.append(f'{self.name}_sum{_label_text(self.label_names, key)} {total}')
+                lines.append(f'{self.name}_count{_label_text(self.label_names, key)} {count}')
+        return lines
+
+# ----------------------------------------------------------------------------------------- #
+# Crawl pipeline metrics
+stage_seconds = Histogram(
+    'crawl_stage_seconds',
+    'Time spent in each crawl pipeline stage',
+    ('stage',)) # driver_startup, page_load, scroll_wait, extract, db_commit, render, telegram_upload
+posts_crawled = Counter('crawl_posts_crawled_total', 'Posts extracted by crawls')
+duplicates_skipped = Counter('crawl_duplicate_posts_total', 'Posts skipped as already crawled in the same crawl')
+posts_dropped = Counter('crawl_posts_dropped_total', 'Posts dropped for missing data fields')
+errors = Counter('crawl_errors_total', 'Errors by stage and exception type', ('stage', 'type'))
+
+REGISTRY = (stage_seconds, posts_crawled, duplicates_skipped, posts_dropped, errors)
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# ----------------------------------------------------------------------------------------- #
+# Metrics server - crawl worker and bot processes serve their own metrics on a port of their
+# own, as metrics are kept per process and the web tier's /metrics only has its own
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood the process output
+
+def serve_metrics(port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on port {server.server_port}")
+    return server
@@ -0,0 +1,102 @@
+import gzip
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+
+from reddit_crawler import POST_ATTRIBUTES
+
+try:
+    import zstandard # Optional, snapshots are gzip compressed when it is not installed
+except ImportError:
+    zstandard = None
+
+# ----------------------------------------------------------------------------------------- #
+# Snapshot files - the raw pages of a crawl, '<report>.html.zst' for the final page HTML of a
+# selenium crawl or '<report>.json.gz' for the listing pages of an http crawl
+COMPRESSIONS = ('zst', 'gz')
+READ_CHUNK = 256 * 1024
+
+def default_compression() -> str:
+    compression = os.getenv('PAGE_ARCHIVE_COMPRESSION', 'zst' if zstandard else 'gz')
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown archive compression {compression}")
+    if compression == 'zst' and not zstandard:
+        print("WARNING: zstandard is not installed, archiving pages with gzip")
+        return 'gz'
+    return compression
+
+def _open_text(path: str, mode: str, compression: str = None):
+    if (compression or path.rsplit('.', 1)[-1]) == 'zst':
+        if not zstandard:
+            raise RuntimeError(f"zstandard is needed to read {path}")
+        if mode == 'w':
+            return io.TextIOWrapper(zstandard.ZstdCompressor(level=10).stream_writer(open(path, 'wb')), encoding='utf-8')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')), encoding='utf-8')
+    return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=6)
+
+def write_snapshot(directory: str, report_file: str, pages: list, compression: str = None) -> str:
+    """
+        Writes the pages a crawl collected and returns the snapshot file name. Pages are HTML
+        strings from the selenium backend or listing data dicts from the http backend
+    """
+    kind = 'json' if isinstance(pages[0], dict) else 'html'
+    compression = compression or default_compression()
+    filename = f"{os.path.splitext(report_file)[0]}.{kind}.{compression}"
+    path = os.path.join(directory, filename)
+    with _open_text(path + '.tmp', 'w', compression) as f: # Renamed into place so readers never see half a file
+        if kind == 'json':
+            json.dump(pages, f)
+        else:
+            f.write(pages[-1]) # The final page holds every post the crawl scrolled past
+    os.replace(path + '.tmp', path)
+    return filename
+
+# ----------------------------------------------------------------------------------------- #
+# Re-extraction - reads shreddit-post attributes straight from the compressed stream
+class ShredditPostParser(HTMLParser):
+    """
+        Streaming parser that only looks at shreddit-post start tags, the rest of the page is skipped
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.records = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'shreddit-post':
+            attributes = dict(attrs)
+            self.records.append({name: attributes.get(name) for name in POST_ATTRIBUTES})
+
+def extract_snapshot(path: str) -> list[dict]:
+    """
+        Post attribute records in page order, the same records the crawl backends collect
+    """
+    if '.json.' in os.path.basename(path):
+        from http_crawler import HttpBackend
+        with _open_text(path, 'r') as f:
+            pages = json.load(f)
+        return [HttpBackend.listing_attributes(child) for page in pages for child in page.get('children', [])]
+
+    parser = ShredditPostParser()
+    with _open_text(path, 'r') as f:
+        while chunk := f.read(READ_CHUNK):
+            parser.feed(chunk)
+    parser.close()
+    return parser.records
+
+def _extract_job(path: str) -> tuple[str, list[dict] | None, str | None]:
+    try:
+        return path, extract_snapshot(path), None
+    except Exception as e: # Reported per snapshot so one bad file does not stop a backfill
+        return path, None, f"{type(e).__name__}: {e}"
+
+def extract_snapshots(paths: list[str], processes: int = None):
+    """
+        Parses many snapshots across a process pool, yields (path, records, error) in the order of paths
+    """
+    if len(paths) <= 1 or processes == 1:
+        yield from map(_extract_job, paths)
+        return
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        yield from executor.map(_extract_job, paths, chunksize=4)
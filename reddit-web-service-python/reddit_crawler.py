@@ -1,21 +1,17 @@
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
 
-from bs4 import BeautifulSoup
 import os
+import threading
 import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
-from selenium import webdriver
-from selenium.webdriver.support.wait import WebDriverWait
-
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-
-from selenium.webdriver.common.by import By
+# BeautifulSoup and selenium's waits are imported where they are used, only crawling needs them
 from selenium.common.exceptions import WebDriverException, TimeoutException, NoSuchElementException
-from selenium.webdriver.support import expected_conditions as EC
+
+from driver_pool import BROWSER_MODES, DriverPool, get_driver_pool
+import metrics
 
 # ----------------------------------------------------------------------------------------- #
 # Post dataclass for crawling use
@@ -24,124 +20,366 @@ class Post:
     unique_id: str
     perma_link: str
     href_content: str
-    comment_count: str
+    comment_count: int
     post_title: str
     post_author: str
-    post_score: str
+    post_score: int
     media_content: None
     timestamp: float = field(default_factory=lambda: datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
 
+# ----------------------------------------------------------------------------------------- #
+# Scroll wait policy - how long to wait for Reddit to render more posts after each scroll
+@dataclass
+class ScrollWaitPolicy:
+    timeout: float = 20.0           # Give up on a scroll if nothing new renders in this time
+    poll_interval: float = 0.1      # First poll delay after scrolling
+    backoff: float = 1.5            # Poll delay multiplier while nothing has changed
+    max_interval: float = 2.0       # Upper bound on the poll delay
+    max_scrolls: int = 25           # Upper bound on scrolls per crawl
+
+    @classmethod
+    def from_env(cls) -> "ScrollWaitPolicy":
+        """
+            Builds a policy from SCROLL_WAIT_* environment variables, falling back to the defaults
+        """
+        defaults = cls()
+        return cls(
+            timeout=float(os.getenv('SCROLL_WAIT_TIMEOUT', defaults.timeout)),
+            poll_interval=float(os.getenv('SCROLL_WAIT_POLL_INTERVAL', defaults.poll_interval)),
+            backoff=float(os.getenv('SCROLL_WAIT_BACKOFF', defaults.backoff)),
+            max_interval=float(os.getenv('SCROLL_WAIT_MAX_INTERVAL', defaults.max_interval)),
+            max_scrolls=int(os.getenv('SCROLL_WAIT_MAX_SCROLLS', defaults.max_scrolls))
+        )
+
+# Post count and page height in a single round trip to the browser
+PAGE_STATE_SCRIPT = "return [document.getElementsByTagName('shreddit-post').length, document.body.scrollHeight];"
+
+def wait_for_new_posts(driver, post_count: int, height: int, policy: ScrollWaitPolicy) -> tuple[bool, int, int]:
+    """
+        Polls the page with backoff until more shreddit-post elements render or the page grows,
+        returns whether anything changed along with the latest post count and page height
+    """
+    deadline = time.monotonic() + policy.timeout
+    interval = policy.poll_interval
+    while True:
+        time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+        current_count, current_height = driver.execute_script(PAGE_STATE_SCRIPT)
+        if current_count > post_count or current_height != height:
+            return True, current_count, current_height
+        if time.monotonic() >= deadline:
+            return False, current_count, current_height
+        interval = min(interval * policy.backoff, policy.max_interval)
+
+# ----------------------------------------------------------------------------------------- #
+# Per host rate limiter - spaces out listing fetches to the same host across concurrent crawls
+class HostRateLimiter:
+    """
+        Hands out request slots per host no closer together than 1 / requests_per_second,
+        a rate of 0 or less disables limiting
+    """
+    def __init__(self, requests_per_second: float):
+        self.requests_per_second = requests_per_second
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host: str) -> None:
+        if self.requests_per_second <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1 / self.requests_per_second
+        if slot > now:
+            time.sleep(slot - now)
+
+# Shared by every backend so concurrent crawls respect one limit per host
+rate_limiter = HostRateLimiter(float(os.getenv('CRAWL_RATE_LIMIT', '1')))
+
+# ----------------------------------------------------------------------------------------- #
+# Post extraction - the shreddit-post attributes we read and how they become a Post
+POST_ATTRIBUTES = ('id', 'permalink', 'content-href', 'comment-count', 'post-title', 'author', 'score')
+EXTRACTION_MODES = ('browser', 'soup')
+
+# Reads the attributes of shreddit-post elements not yet seen and marks them as crawled,
+# so each scroll only ships the new posts back from the browser
+EXTRACT_NEW_POSTS_SCRIPT = """
+const attributes = arguments[0];
+const records = [];
+for (const post of document.querySelectorAll('shreddit-post:not([data-crawled])')) {
+    post.setAttribute('data-crawled', '');
+    const record = {};
+    for (const name of attributes) record[name] = post.getAttribute(name);
+    records.push(record);
+}
+return records;
+"""
+
+def extract_posts_from_html(html: str) -> list[dict]:
+    """
+        Fallback extraction - parses the full page source with BeautifulSoup
+    """
+    from bs4 import BeautifulSoup
+
+    soupy = BeautifulSoup(html, "html.parser")
+    return [{name: post_element.get(name) for name in POST_ATTRIBUTES}
+            for post_element in soupy.find_all('shreddit-post')]
+
+def detect_media(href_content: str) -> str | None:
+    """
+        Parses and checks for media content, by file extension or a v.redd.it link
+    """
+    if href_content:
+        parsed = urllib.parse.urlparse(href_content)
+        path_extension = os.path.splitext(parsed.path)[1].lower()
+        images = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+        videos = ('.mp4', '.webm')
+        if path_extension in images or path_extension in videos:
+            return href_content
+        elif 'v.redd.it' in href_content:
+            return href_content
+    return None
+
+def parse_count(value) -> int:
+    """
+        Converts a score or comment count attribute to an integer, 0 when missing or malformed
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def build_post(attributes: dict) -> Post | None:
+    """
+        Builds a Post from shreddit-post attributes, None if an important field is missing
+    """
+    unique_id = attributes.get('id')
+    perma_link = attributes.get('permalink')
+    href_content = attributes.get('content-href')
+    post_title = attributes.get('post-title')
+    post_author = attributes.get('author')
+    if not (unique_id and perma_link and post_title and post_author):
+        return None
+
+    return Post(
+        unique_id=unique_id,
+        perma_link=perma_link,
+        href_content=href_content if href_content else perma_link,
+        comment_count=parse_count(attributes.get('comment-count')),
+        post_title=post_title,
+        post_author=post_author,
+        post_score=parse_count(attributes.get('score')),
+        media_content=detect_media(href_content))
+
+def collect_posts(records: list[dict], crawled_posts: list[Post], unique_ids: set[str],
+                  stop_at: set[str] = None) -> tuple[list[Post], bool]:
+    """
+        Adds the posts built from records that have not been seen yet, in page order. With stop_at
+        (the ids stored by the previous crawl) it stops at the first known post and reports it
+    """
+    for attributes in records:
+        unique_id = attributes.get('id')
+        if stop_at and unique_id in stop_at:
+            return crawled_posts, True
+        if unique_id and unique_id in unique_ids: # Prevent duplicate post saving
+            metrics.duplicates_skipped.inc()
+            continue
+        post = build_post(attributes)
+        if post: # Ensures that the important data fields are present
+            crawled_posts.append(post)
+            unique_ids.add(unique_id)
+            metrics.posts_crawled.inc()
+        else:
+            metrics.posts_dropped.inc()
+            print(f"Skipping due to missing data fields")
+    return crawled_posts, False
+
+# ----------------------------------------------------------------------------------------- #
+# Crawl backends - every backend turns a subreddit listing into a list of Post dataclasses
+class CrawlBackend:
+    """
+        Base class for crawl backends, crawl raises on failure so callers can fall back.
+        With stop_at a backend stops as soon as it reaches a post id in that set, and with a
+        snapshots list it appends the raw pages the posts were read from for archiving
+    """
+    name = None
+
+    def crawl(self, subreddit: str, sort: str, target_posts: int, stop_at: set[str] = None,
+              snapshots: list = None) -> list[Post]:
+        raise NotImplementedError
+
+class SeleniumBackend(CrawlBackend):
+    """
+        Scrolls the subreddit page in a pooled headless Chrome and reads the shreddit-post elements
+    """
+    name = 'selenium'
+
+    def __init__(self, pool: DriverPool = None, wait_policy: ScrollWaitPolicy = None, extraction: str = None,
+                 browser_mode: str = None):
+        if browser_mode and browser_mode not in BROWSER_MODES:
+            raise ValueError(f"Unknown browser mode {browser_mode}")
+        self.pool = pool
+        self.wait_policy = wait_policy
+        self.extraction = extraction
+        self.browser_mode = browser_mode
+
+    def crawl(self, subreddit: str, sort: str, target_posts: int, stop_at: set[str] = None,
+              snapshots: list = None) -> list[Post]:
+        url = f"https://www.reddit.com/r/{subreddit}/{sort}" # allows for future improvements
+        print(f"Beginning crawl for subreddit {url}")
+
+        extraction = self.extraction or os.getenv('CRAWL_EXTRACTION_MODE', 'browser')
+        if extraction not in EXTRACTION_MODES:
+            raise ValueError(f"Unknown extraction mode {extraction}")
+
+        with (self.pool or get_driver_pool(self.browser_mode)).lease() as driver:
+            return _crawl_page(driver, url, target_posts, self.wait_policy or ScrollWaitPolicy.from_env(),
+                               extraction, stop_at, snapshots)
+
+# Backends other than selenium are shared so their HTTP sessions stay warm between crawls
+_backends = {}
+
+def get_backend(name: str) -> CrawlBackend:
+    if name == 'selenium':
+        return SeleniumBackend()
+    if name not in _backends:
+        if name == 'http':
+            from http_crawler import HttpBackend # Imported here as http_crawler builds on this module
+            _backends[name] = HttpBackend()
+        else:
+            raise ValueError(f"Unknown crawl backend {name}")
+    return _backends[name]
+
 # ----------------------------------------------------------------------------------------- #
 # Main crawling function - takes in parameters such as subreddit name, sort by and how many to crawl
-def crawl_subreddit(subreddit: str, sort: str , target_posts : int ) -> list[Post]:
+def crawl_subreddit(subreddit: str, sort: str , target_posts : int, pool: DriverPool = None,
+                    wait_policy: ScrollWaitPolicy = None, extraction: str = None, backend: str = None,
+                    stop_at: set[str] = None, snapshots: list = None, browser_mode: str = None,
+                    raise_errors: bool = False) -> list[Post]:
     """
         Crawls a subreddit of your choice with a set target of posts to crawl
         these posts are created as a Post dataclass before database entry and commit
+        backend is 'selenium' (pooled headless Chrome) or 'http' (listing API, falls back to selenium)
+        the Chrome driver is leased from the warm driver pool rather than started per crawl
+        and each scroll only waits as long as the wait policy needs for new posts to render
+        extraction is 'browser' (new posts read in the page) or 'soup' (full page_source parse)
+        stop_at is the set of unique_ids from the previous crawl, an incremental crawl of sort=new
+        stops scrolling at the first of them and only returns the posts newer than it
+        snapshots, when given, receives the final page HTML (selenium) or the listing pages (http)
+        browser_mode picks the selenium driver pool, 'full' or 'lean' (blocks media, fonts, ads and
+        tracking and loads pages eagerly), CRAWL_BROWSER_MODE by default
+        a failed crawl returns an empty list, or raises with raise_errors so that an incremental
+        crawl can tell a failure from a crawl with no new posts
     """
-    url = f"https://www.reddit.com/r/{subreddit}/{sort}" # allows for future improvements
-    print(f"Beginning crawl for subreddit {url}")
-
-    # Settings for Chrome web engine
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--window-size=1920x1080")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36")
-    driver = None
+    backend = backend or os.getenv('CRAWL_BACKEND', 'selenium')
 
     try:
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=chrome_options)
+        selenium_backend = SeleniumBackend(pool, wait_policy, extraction, browser_mode)
+        if backend != 'selenium':
+            try:
+                crawled_posts = get_backend(backend).crawl(subreddit, sort, target_posts, stop_at, snapshots)
+                if crawled_posts:
+                    return crawled_posts
+                print(f"WARNING: {backend} backend returned no posts, falling back to selenium")
+            except Exception as e:
+                metrics.errors.inc(stage=backend, type=type(e).__name__)
+                print(f"WARNING: {backend} backend failed: {e}, falling back to selenium")
 
-        driver.set_page_load_timeout(90)
-        driver.get(url)
-
-        # Wait until at least one 'shreddit-post' element is present
-        WebDriverWait(driver, 60).until(
-            EC.presence_of_element_located((By.TAG_NAME, "shreddit-post"))
-        )
-        print("At least one 'shreddit-post' element found. Starting crawl loop.")
-
-        crawled_posts = []
-        attempts = 0
-        max_attempts = 5
-        height = driver.execute_script("return document.body.scrollHeight")
-        unique_ids = set()
-
-        while len(crawled_posts) < target_posts and attempts < max_attempts:
-            print(f"Attempt {attempts}/{max_attempts}")
-
-            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(20)
-
-            current_height = driver.execute_script("return document.body.scrollHeight")
-            if current_height == height:
-                print(f"Unable to scroll down.")
-                break
-            height = current_height
-            attempts += 1
-
-            soupy = BeautifulSoup(driver.page_source, "html.parser")
-            html_posts = soupy.find_all('shreddit-post')
-            print(f"Crawled {len(html_posts)} posts")
-
-            # Iterates through the elements under shreddit-post to find the attributes we need
-            for post_element in html_posts:
-                unique_id = post_element.get('id')
-                if unique_id and unique_id not in unique_ids: # Prevent duplicate post saving
-                    perma_link = post_element.get('permalink')
-                    href_content = post_element.get('content-href')
-                    comment_count_str = post_element.get('comment-count')
-                    post_title = post_element.get('post-title')
-                    post_author = post_element.get('author')
-                    post_score_str = post_element.get('score')
-
-                    # Parses and checks for media content
-                    media_content = None
-                    if href_content:
-                        parsed = urllib.parse.urlparse(href_content)
-                        path_extension = os.path.splitext(parsed.path)[1].lower()
-                        images = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
-                        videos = ('.mp4', '.webm')
-                        if path_extension in images or path_extension in videos:
-                            media_content = href_content
-                        elif 'v.redd.it' in href_content:
-                            media_content = href_content
-
-                    # Ensures that the important data fields are present
-                    if unique_id and perma_link and post_title and post_author:
-                        crawled_posts.append(Post(
-                            unique_id=unique_id,
-                            perma_link=perma_link,
-                            href_content=href_content if href_content else perma_link,
-                            comment_count=comment_count_str,
-                            post_title=post_title,
-                            post_author=post_author,
-                            post_score=post_score_str,
-                            media_content=media_content))
-
-                        unique_ids.add(unique_id)
-                    else:
-                        print(f"Skipping due to missing data fields")
-            if len(crawled_posts) >= target_posts:
-                print(f"Crawled {len(crawled_posts)}/{target_posts} posts")
-                break
-
-            print(f"Crawling {len(crawled_posts)}/{target_posts}")
-        print(f"Crawling complete. Total posts: {len(crawled_posts)}")
-        return crawled_posts
+        if snapshots:
+            snapshots.clear() # Pages from a failed backend are not archived with the fallback's posts
+        return selenium_backend.crawl(subreddit, sort, target_posts, stop_at, snapshots)
 
     # Error handling
-    except TimeoutException:
+    except TimeoutException as e:
+        metrics.errors.inc(stage='crawl', type=type(e).__name__)
         print("ERROR: Timeout error")
+        if raise_errors:
+            raise
         return []
     except WebDriverException as e:
+        metrics.errors.inc(stage='crawl', type=type(e).__name__)
         print(f"ERROR: Web Driver error: {e} ")
+        if raise_errors:
+            raise
         return []
     except Exception as e:
+        metrics.errors.inc(stage='crawl', type=type(e).__name__)
         print("ERROR: Unexpected error:", e)
+        if raise_errors:
+            raise
         return []
-    finally:
-        if driver:
-            driver.quit()
+
+# ----------------------------------------------------------------------------------------- #
+# Batch crawling - takes in (subreddit, sort, target_posts) tuples and crawls them concurrently
+def crawl_batch(crawl_requests: list[tuple[str, str, int]], concurrency: int = None, **crawl_options) -> list[list[Post]]:
+    """
+        Runs crawl_subreddit for every request with at most concurrency crawls at once,
+        listing fetches stay under the shared per host rate limit. Results are returned
+        in the same order as the requests, a failed crawl gives an empty list
+    """
+    concurrency = concurrency or int(os.getenv('CRAWL_BATCH_CONCURRENCY', '4'))
+    print(f"Beginning batch crawl of {len(crawl_requests)} subreddits, {concurrency} at a time")
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-crawl") as executor:
+        futures = [executor.submit(crawl_subreddit, subreddit, sort, target_posts, **crawl_options)
+                   for subreddit, sort, target_posts in crawl_requests]
+        return [future.result() for future in futures]
+
+# Scroll and extract loop, runs on a leased driver
+def _crawl_page(driver, url: str, target_posts: int, wait_policy: ScrollWaitPolicy, extraction: str,
+                stop_at: set[str] = None, snapshots: list = None) -> list[Post]:
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.wait import WebDriverWait
+
+    host = urllib.parse.urlparse(url).netloc
+    rate_limiter.wait(host)
+    with metrics.stage_seconds.time(stage='page_load'):
+        driver.get(url)
+
+        # Wait until at least one 'shreddit-post' element is present
+        WebDriverWait(driver, 60).until(
+            EC.presence_of_element_located((By.TAG_NAME, "shreddit-post"))
+        )
+    print("At least one 'shreddit-post' element found. Starting crawl loop.")
+
+    crawled_posts = []
+    attempts = 0
+    max_attempts = wait_policy.max_scrolls
+    post_count, height = driver.execute_script(PAGE_STATE_SCRIPT)
+    unique_ids = set()
+
+    # Posts already on screen are read before the first scroll, so an incremental crawl that
+    # meets a known post straight away never scrolls at all
+    while True:
+        # Only posts not returned by a previous scroll are extracted
+        with metrics.stage_seconds.time(stage='extract'):
+            if extraction == 'soup':
+                records = extract_posts_from_html(driver.page_source)
+            else:
+                records = driver.execute_script(EXTRACT_NEW_POSTS_SCRIPT, list(POST_ATTRIBUTES))
+            print(f"Crawled {len(records)} posts")
+
+            crawled_posts, reached_known = collect_posts(records, crawled_posts, unique_ids, stop_at)
+        if reached_known:
+            print(f"Reached posts from the previous crawl, stopping with {len(crawled_posts)} new posts")
+            break
+        if len(crawled_posts) >= target_posts:
+            print(f"Crawled {len(crawled_posts)}/{target_posts} posts")
+            break
+        if attempts >= max_attempts:
+            break
+
+        print(f"Crawling {len(crawled_posts)}/{target_posts}")
+        print(f"Attempt {attempts}/{max_attempts}")
+        rate_limiter.wait(host) # Each scroll fetches the next listing page
+        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        with metrics.stage_seconds.time(stage='scroll_wait'):
+            changed, post_count, height = wait_for_new_posts(driver, post_count, height, wait_policy)
+        if not changed:
+            print(f"Unable to scroll down.")
+            break
+        attempts += 1
+
+    if snapshots is not None:
+        snapshots.append(driver.page_source)
+    print(f"Crawling complete. Total posts: {len(crawled_posts)}")
+    return crawled_posts[:target_posts]
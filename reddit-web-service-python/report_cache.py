@@ -0,0 +1,123 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from flask import make_response
+
+try:
+    import brotli # Optional, brotli variants are skipped when it is not installed
+except ImportError:
+    brotli = None
+
+# ----------------------------------------------------------------------------------------- #
+# Rendered report - the HTML plus its precompressed variants and validator
+@dataclass
+class CachedReport:
+    etag: str
+    body: bytes
+    gzip_body: bytes
+    brotli_body: bytes | None
+    mtime: float | None
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzip_body) + len(self.brotli_body or b'')
+
+def build_cached_report(body: bytes, mtime: float | None) -> CachedReport:
+    return CachedReport(
+        etag=hashlib.sha1(body).hexdigest(),
+        body=body,
+        gzip_body=gzip.compress(body, compresslevel=9),
+        brotli_body=brotli.compress(body) if brotli else None,
+        mtime=mtime
+    )
+
+# ----------------------------------------------------------------------------------------- #
+# Rendered report cache - size bounded LRU in memory, backed by the report files on disk
+class ReportCache:
+    """
+        Reports are immutable once crawled, so the rendered HTML is cached by report id.
+        Entries are checked against the report file's mtime on every hit, so a file that was
+        regenerated or deleted by another process is never served stale
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _mtime(path: str) -> float | None:
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def get(self, report_id: int, path: str, render) -> CachedReport:
+        """
+            Returns the cached report, loading it from disk or calling render() to write it
+        """
+        mtime = self._mtime(path)
+        with self._lock:
+            entry = self._entries.get(report_id)
+            if entry and mtime is not None and entry.mtime == mtime:
+                self._entries.move_to_end(report_id)
+                return entry
+
+        if mtime is None:
+            html = render() # Writes the report file as well
+            mtime = self._mtime(path)
+            body = html.encode('utf-8')
+        else:
+            with open(path, 'rb') as f:
+                body = f.read()
+
+        entry = build_cached_report(body, mtime)
+        self._store(report_id, entry)
+        return entry
+
+    def _store(self, report_id: int, entry: CachedReport) -> None:
+        with self._lock:
+            previous = self._entries.pop(report_id, None)
+            if previous:
+                self._bytes -= previous.size
+            if entry.size > self.max_bytes:
+                return
+            self._entries[report_id] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+
+    def invalidate(self, report_id: int) -> None:
+        with self._lock:
+            entry = self._entries.pop(report_id, None)
+            if entry:
+                self._bytes -= entry.size
+
+# ----------------------------------------------------------------------------------------- #
+# Response helper - conditional GET and content negotiation for a cached report
+def cached_report_response(entry: CachedReport, request):
+    etag = entry.etag
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        encodings = request.accept_encodings
+        if entry.brotli_body and encodings['br']:
+            response = make_response(entry.brotli_body)
+            response.headers['Content-Encoding'] = 'br'
+        elif encodings['gzip']:
+            response = make_response(entry.gzip_body)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = make_response(entry.body)
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+
+    response.set_etag(etag, weak=True) # Weak as the same etag covers every encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Revalidated on every view, a 304 is cheap and deleted or regenerated reports show at once
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,117 @@
+import csv
+import importlib.util
+import io
+import json
+
+# Optional, Parquet exports are unavailable when it is not installed. Only looked up here,
+# pyarrow is imported by the first Parquet export
+PARQUET_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+# ----------------------------------------------------------------------------------------- #
+# Export rows - one post snapshot with its post and report, in the column order of every format
+EXPORT_COLUMNS = (
+    ('report_id', 'int'), ('subreddit', 'str'), ('sort', 'str'), ('report_timestamp', 'str'),
+    ('rank', 'int'), ('unique_id', 'str'), ('post_title', 'str'), ('post_author', 'str'),
+    ('perma_link', 'str'), ('href_content', 'str'), ('media_content', 'str'),
+    ('post_score', 'int'), ('comment_count', 'int'), ('timestamp', 'str')
+)
+COLUMN_NAMES = tuple(name for name, _ in EXPORT_COLUMNS)
+
+EXPORT_FORMATS = {
+    'ndjson' : ('application/x-ndjson', 'ndjson'),
+    'csv' : ('text/csv; charset=utf-8', 'csv'),
+    'parquet' : ('application/vnd.apache.parquet', 'parquet')
+}
+
+# Rows are buffered into chunks of this many before they are written, so a response is a few
+# hundred writes per million rows instead of one per row
+CHUNK_ROWS = 1000
+
+def _chunks(rows, size: int = CHUNK_ROWS):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# ----------------------------------------------------------------------------------------- #
+# Writers - each takes an iterable of row tuples in COLUMN_NAMES order and yields bytes
+def write_ndjson(rows):
+    for chunk in _chunks(rows):
+        yield ''.join(json.dumps(dict(zip(COLUMN_NAMES, row)), ensure_ascii=False) + '\n'
+                      for row in chunk).encode('utf-8')
+
+def write_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMN_NAMES)
+    for chunk in _chunks(rows):
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell(): # Header only, nothing matched
+        yield buffer.getvalue().encode('utf-8')
+
+class _ChunkSink(io.RawIOBase):
+    """
+        Write only file the Parquet writer writes into, the bytes are taken out after every row group
+    """
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self) -> bytes:
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+def write_parquet(rows, row_group_rows: int = 50000):
+    """
+        One row group per row_group_rows rows, so only one row group is held in memory
+    """
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("pyarrow is needed for Parquet exports")
+    import pyarrow
+    import pyarrow.parquet
+
+    types = {'int': pyarrow.int64(), 'str': pyarrow.string()}
+    schema = pyarrow.schema([(name, types[kind]) for name, kind in EXPORT_COLUMNS])
+
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for chunk in _chunks(rows, row_group_rows):
+            columns = list(zip(*chunk))
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            yield sink.take()
+    finally:
+        writer.close() # Writes the footer, also on an empty export
+    yield sink.take()
+
+WRITERS = {'ndjson': write_ndjson, 'csv': write_csv, 'parquet': write_parquet}
+
+def check_format(export_format: str) -> str | None:
+    """
+        Error message for a format that cannot be exported, None when it can
+    """
+    if export_format not in EXPORT_FORMATS:
+        return f"Unknown export format, expected one of {', '.join(EXPORT_FORMATS)}"
+    if export_format == 'parquet' and not PARQUET_AVAILABLE:
+        return "Parquet exports need pyarrow to be installed"
+    return None
@@ -0,0 +1,123 @@
+import threading
+from datetime import datetime, timedelta
+
+from crawl_jobs import utc_now
+
+# ----------------------------------------------------------------------------------------- #
+# Cron expressions - "minute hour day-of-month month day-of-week" with *, */n, a-b, a-b/n and lists,
+# Sunday is day-of-week 0 or 7
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+def _parse_field(field: str, low: int, high: int) -> set[int]:
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-'))
+        else:
+            start = end = int(part)
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Cron field '{field}' is out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    """
+        Parsed cron expression, next_after gives the first matching minute after a datetime
+    """
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        fields = CRON_ALIASES.get(self.expression, self.expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression '{expression}' needs 5 fields")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELDS))
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        # As in standard cron a field starting with * (*/2 too) does not restrict the day
+        self.any_day = fields[2].startswith('*')
+        self.any_weekday = fields[4].startswith('*')
+
+    def _day_matches(self, day: datetime) -> bool:
+        if day.month not in self.months:
+            return False
+        day_match = day.day in self.days
+        weekday_match = (day.weekday() + 1) % 7 in self.weekdays # cron counts Sunday as 0
+        if self.any_day or self.any_weekday: # Standard cron, a restricted day field only needs one match
+            return day_match and weekday_match
+        return day_match or weekday_match
+
+    def next_after(self, after: datetime) -> datetime:
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+# ----------------------------------------------------------------------------------------- #
+# Scheduler - queues a crawl job for every saved schedule that is due
+class CrawlScheduler:
+    """
+        Checks saved schedules every interval seconds. A due schedule is claimed by moving its
+        next_run_at forward with a conditional UPDATE, so only one process queues each run,
+        then enqueue(schedule) queues the crawl job
+    """
+    def __init__(self, app, db, schedule_model, enqueue, interval: float = 30.0):
+        self.app = app
+        self.db = db
+        self.schedule_model = schedule_model
+        self.enqueue = enqueue
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name="crawl-scheduler", daemon=True)
+        self._thread.start()
+        print("Crawl scheduler started")
+
+    def shutdown(self) -> None:
+        self._stop.set()
+
+    def tick(self) -> int:
+        """
+            Queues every due schedule once, returns how many were queued
+        """
+        Schedule = self.schedule_model
+        now = utc_now()
+        queued = 0
+        for schedule in Schedule.query.filter(Schedule.enabled.is_(True), Schedule.next_run_at <= now).all():
+            next_run = CronSchedule(schedule.cron).next_after(now)
+            claimed = (Schedule.query.filter_by(id=schedule.id, next_run_at=schedule.next_run_at)
+                       .update({'next_run_at': next_run, 'last_run_at': now}))
+            self.db.session.commit()
+            if claimed:
+                self.enqueue(schedule)
+                queued += 1
+                print(f"Scheduled crawl {schedule.id} queued for r/{schedule.subreddit}/{schedule.sort}, next run {next_run}")
+        return queued
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.tick()
+            except Exception as e:
+                print(f"ERROR: Scheduler error: {e}")
+            self._stop.wait(self.interval)
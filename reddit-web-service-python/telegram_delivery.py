@@ -0,0 +1,200 @@
+import asyncio
+import os
+import time
+from datetime import timedelta
+
+import metrics
+from crawl_jobs import utc_now
+
+# ----------------------------------------------------------------------------------------- #
+# Delivery states - queued -> sending -> sent, or back to queued with backoff until failed
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+# ----------------------------------------------------------------------------------------- #
+# Rate limiter for the sender - one global rate plus a minimum gap between sends to a chat
+class TelegramRateLimiter:
+    """
+        Telegram allows about 30 messages a second overall and one a second per chat
+    """
+    def __init__(self, messages_per_second: float = 25.0, chat_interval: float = 1.0):
+        self.global_interval = 1 / messages_per_second
+        self.chat_interval = chat_interval
+        self._next_global = 0.0
+        self._next_chat = {}
+
+    def chat_delay(self, chat_id: str) -> float:
+        """
+            Seconds until the chat may receive another message
+        """
+        return max(self._next_chat.get(chat_id, 0.0) - time.monotonic(), 0.0)
+
+    async def acquire(self, chat_id: str) -> None:
+        now = time.monotonic()
+        slot = max(now, self._next_global, self._next_chat.get(chat_id, now))
+        self._next_global = slot + self.global_interval
+        self._next_chat[chat_id] = slot + self.chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+# ----------------------------------------------------------------------------------------- #
+# Telegram sender - drains the persistent delivery queue on the bot's event loop
+class TelegramSender:
+    """
+        Sends queued report deliveries one at a time on the bot's event loop. The first upload
+        of a report stores the file_id Telegram returns, so later recipients are sent the file_id
+        instead of the file. Failed sends are retried with exponential backoff and RetryAfter is
+        honoured; database work runs in a thread so the loop is never blocked
+    """
+    def __init__(self, app, db, delivery_model, report_model, ensure_report_file,
+                 rate_limiter: TelegramRateLimiter = None, max_attempts: int = 5,
+                 retry_backoff: float = 10.0, poll_interval: float = 2.0):
+        self.app = app
+        self.db = db
+        self.delivery_model = delivery_model
+        self.report_model = report_model
+        self.ensure_report_file = ensure_report_file
+        self.rate_limiter = rate_limiter or TelegramRateLimiter()
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self._loop = None
+        self._wake = None
+
+    def notify(self) -> None:
+        """
+            Wakes the sender from any thread, it also polls so other processes can queue sends
+        """
+        if self._loop and self._wake:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # Database helpers, run through asyncio.to_thread
+    def _recover(self) -> None:
+        with self.app.app_context():
+            Delivery = self.delivery_model
+            Delivery.query.filter_by(status=SENDING).update({'status': QUEUED})
+            self.db.session.commit()
+
+    def _due(self, limit: int) -> list[int]:
+        with self.app.app_context():
+            Delivery = self.delivery_model
+            rows = (Delivery.query.with_entities(Delivery.id)
+                    .filter(Delivery.status == QUEUED, Delivery.next_attempt_at <= utc_now())
+                    .order_by(Delivery.next_attempt_at, Delivery.id).limit(limit).all())
+            return [delivery_id for (delivery_id,) in rows]
+
+    def _begin(self, delivery_id: int) -> dict | None:
+        with self.app.app_context():
+            Delivery = self.delivery_model
+            claimed = Delivery.query.filter_by(id=delivery_id, status=QUEUED).update({'status': SENDING})
+            self.db.session.commit()
+            if not claimed:
+                return None
+
+            delivery = self.db.session.get(Delivery, delivery_id)
+            report = self.db.session.get(self.report_model, delivery.report_id)
+            if report is None:
+                self._update(delivery_id, status=FAILED, error='Report no longer exists')
+                return None
+            try:
+                path = None if report.telegram_file_id else self.ensure_report_file(report)
+            except Exception as e:
+                self._update(delivery_id, status=FAILED, error=f'Report file unavailable: {e}'[:500])
+                return None
+            return {
+                'chat_id': delivery.chat_id,
+                'caption': delivery.caption,
+                'attempts': delivery.attempts,
+                'report_id': report.id,
+                'file_id': report.telegram_file_id,
+                'path': path
+            }
+
+    def _update(self, delivery_id: int, **values) -> None:
+        with self.app.app_context():
+            self.delivery_model.query.filter_by(id=delivery_id).update(values)
+            self.db.session.commit()
+
+    def _remember_file_id(self, report_id: int, file_id: str) -> None:
+        with self.app.app_context():
+            self.report_model.query.filter_by(id=report_id).update({'telegram_file_id': file_id})
+            self.db.session.commit()
+
+    async def _send(self, bot, delivery_id: int) -> None:
+        from telegram.error import RetryAfter, TelegramError # Loaded with the bot, not by every process
+
+        delivery = await asyncio.to_thread(self._begin, delivery_id)
+        if not delivery:
+            return
+
+        chat_id = delivery['chat_id']
+        delay = self.rate_limiter.chat_delay(chat_id)
+        if delay > 0: # Other chats go first rather than waiting on this one
+            await asyncio.to_thread(self._update, delivery_id, status=QUEUED,
+                                    next_attempt_at=utc_now() + timedelta(seconds=delay))
+            return
+
+        await self.rate_limiter.acquire(chat_id)
+        try:
+            with metrics.stage_seconds.time(stage='telegram_upload'):
+                if delivery['file_id']:
+                    await bot.send_document(chat_id=chat_id, document=delivery['file_id'], caption=delivery['caption'])
+                else:
+                    with open(delivery['path'], 'rb') as f:
+                        message = await bot.send_document(
+                            chat_id=chat_id,
+                            document=f,
+                            filename=os.path.basename(delivery['path']),
+                            caption=delivery['caption']
+                        )
+                    await asyncio.to_thread(self._remember_file_id, delivery['report_id'], message.document.file_id)
+            await asyncio.to_thread(self._update, delivery_id, status=SENT, sent_at=utc_now(),
+                                    attempts=delivery['attempts'] + 1, error=None)
+            print(f"Sent report {delivery['report_id']} to chat {chat_id}")
+
+        except RetryAfter as e: # Flood control, not counted as a failed attempt
+            metrics.errors.inc(stage='telegram_upload', type=type(e).__name__)
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            print(f"WARNING: Telegram flood control, retrying chat {chat_id} in {retry_after}s")
+            await asyncio.to_thread(self._update, delivery_id, status=QUEUED,
+                                    next_attempt_at=utc_now() + timedelta(seconds=retry_after))
+        except (TelegramError, OSError) as e:
+            metrics.errors.inc(stage='telegram_upload', type=type(e).__name__)
+            attempts = delivery['attempts'] + 1
+            if attempts < self.max_attempts:
+                delay = self.retry_backoff * 2 ** (attempts - 1)
+                print(f"ERROR: Telegram send to chat {chat_id} failed, retrying in {delay:.0f}s: {e}")
+                await asyncio.to_thread(self._update, delivery_id, status=QUEUED, attempts=attempts, error=str(e)[:500],
+                                        next_attempt_at=utc_now() + timedelta(seconds=delay))
+            else:
+                print(f"ERROR: Telegram send to chat {chat_id} failed: {e}")
+                await asyncio.to_thread(self._update, delivery_id, status=FAILED, attempts=attempts, error=str(e)[:500])
+
+    async def run(self, bot) -> None:
+        """
+            Sender loop, started as a task on the bot application's event loop
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        await asyncio.to_thread(self._recover)
+        print("Telegram delivery sender started")
+
+        while True:
+            try:
+                due = await asyncio.to_thread(self._due, 50)
+                for delivery_id in due:
+                    await self._send(bot, delivery_id)
+                if due:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ERROR: Telegram sender error: {e}")
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
@@ -0,0 +1,93 @@
+"""
+    Upgrades a database created by the first version of the service and checks the result.
+    Run with: python -m pytest tests
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+# The application is pointed at a scratch database and directories before it is imported
+work_directory = tempfile.mkdtemp(prefix='crawler-test-')
+os.environ['CRAWLER_DATABASE'] = os.path.join(work_directory, 'legacy.db')
+os.environ['REPORT_DIRECTORY'] = os.path.join(work_directory, 'reports')
+os.environ['MEDIA_DIRECTORY'] = os.path.join(work_directory, 'media')
+os.environ['PAGE_ARCHIVE_DIRECTORY'] = os.path.join(work_directory, 'archive')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+# Schema of the first version, one post row per report and post
+LEGACY_SCHEMA = """
+    CREATE TABLE report (
+        id INTEGER PRIMARY KEY, timestamp VARCHAR(100) NOT NULL, subreddit VARCHAR(100) NOT NULL,
+        sort VARCHAR(100) NOT NULL, post_count INTEGER NOT NULL, filename VARCHAR(100) NOT NULL);
+    CREATE TABLE post (
+        id INTEGER PRIMARY KEY, report_id INTEGER NOT NULL REFERENCES report (id),
+        unique_id VARCHAR(500) NOT NULL, perma_link VARCHAR(500) NOT NULL, href_content VARCHAR(500) NOT NULL,
+        comment_count INTEGER NOT NULL, post_title VARCHAR(500) NOT NULL, post_author VARCHAR(500) NOT NULL,
+        post_score INTEGER NOT NULL, media_content VARCHAR(500), timestamp VARCHAR(100) NOT NULL);
+    CREATE TABLE telegram_user (
+        id INTEGER PRIMARY KEY, handle VARCHAR(100) NOT NULL, chat_id VARCHAR(100) NOT NULL);
+"""
+
+def legacy_post(post_id, report_id, number, score):
+    return (post_id, report_id, f't3_{number}', f'/r/memes/comments/{number}/', f'https://i.redd.it/{number}.png',
+            3, f'Post {number}', f'author_{number % 2}', score, f'https://i.redd.it/{number}.png',
+            f'2024-05-0{report_id}T10:00:00Z')
+
+@pytest.fixture(scope='module')
+def application():
+    with sqlite3.connect(os.environ['CRAWLER_DATABASE']) as connection:
+        connection.executescript(LEGACY_SCHEMA)
+        connection.executemany('INSERT INTO report VALUES (?, ?, ?, ?, ?, ?)', [
+            (1, '2024-05-01-100000', 'memes', 'new', 3, 'report_1.pdf'),
+            (2, '2024-05-02-100000', 'memes', 'new', 3, 'report_2.pdf')
+        ])
+        connection.executemany('INSERT INTO post VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+            legacy_post(1, 1, 1, 10), legacy_post(2, 1, 2, 20), legacy_post(3, 1, 3, 30),
+            legacy_post(4, 2, 2, 25), legacy_post(5, 2, 3, 35), legacy_post(6, 2, 4, 5)
+        ])
+    connection.close()
+
+    import crawl_application
+    with crawl_application.app.app_context():
+        crawl_application.db.create_all() # As at start up, before the migration
+        crawl_application.migrate_database()
+        yield crawl_application
+
+def test_posts_are_deduplicated_into_snapshots(application):
+    with application.db.engine.connect() as connection:
+        assert connection.exec_driver_sql('SELECT COUNT(*) FROM post').scalar() == 4
+        assert connection.exec_driver_sql('SELECT COUNT(*) FROM post_snapshot').scalar() == 6
+        assert not application.inspect(connection).has_table('post_legacy')
+
+def test_foreign_keys_point_at_the_new_tables(application):
+    with application.db.engine.connect() as connection:
+        targets = {row[2] for row in connection.exec_driver_sql('PRAGMA foreign_key_list(post_snapshot)')}
+        assert targets == {'post', 'report'}
+        assert connection.exec_driver_sql('PRAGMA foreign_key_check').fetchall() == []
+
+        connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+        connection.exec_driver_sql(
+            "INSERT INTO post_snapshot (report_id, post_id, rank, post_score, comment_count, timestamp) "
+            "VALUES (2, 1, 4, 1, 1, '2024-05-02T10:00:00Z')")
+        connection.rollback()
+
+def day_rollups(application):
+    with application.db.engine.connect() as connection:
+        return connection.exec_driver_sql(
+            'SELECT day, reports, snapshots, new_posts FROM subreddit_day ORDER BY day').fetchall()
+
+def test_analytics_are_rolled_up_from_the_old_reports(application):
+    assert day_rollups(application) == [('2024-05-01', 1, 3, 3), ('2024-05-02', 1, 3, 1)]
+
+    # Already rolled up, so starting again does not rebuild or count the reports twice
+    assert not application.backfill_rollups()
+    assert day_rollups(application) == [('2024-05-01', 1, 3, 3), ('2024-05-02', 1, 3, 1)]
+
+def test_deleting_a_report_moves_its_surviving_posts_to_the_next_report(application):
+    response = application.app.test_client().get('/delete_report/1')
+    assert response.status_code == 302
+    # Posts 2 and 3 were first crawled by report 1 and are new posts of report 2 now
+    assert day_rollups(application) == [('2024-05-02', 1, 3, 3)]